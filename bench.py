@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import json
+import timeit
+import platform
+import subprocess
+import collections
+import argparse
+
+import safeyaml
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+def gen_config(n):
+    lines = []
+    for i in range(n):
+        lines.append("service_{}:".format(i))
+        lines.append("  host: \"host-{}.example.com\"".format(i))
+        lines.append("  port: {}".format(8000 + i))
+        lines.append("  enabled: true")
+        lines.append("  # replicas and tags")
+        lines.append("  tags: [\"a\", \"b\", \"c\"]")
+        lines.append("  limits: {cpu: 0.5, memory: 512}")
+    return "\n".join(lines) + "\n"
+
+
+def gen_strings(n):
+    lines = ["hosts:"]
+    for i in range(n):
+        lines.append("  - \"node-{}.rack-{}.dc1.example.com\"".format(i, i % 40))
+        lines.append("  - 'https://example.com/api/v1/items/{}?page=1'".format(i))
+    return "\n".join(lines) + "\n"
+
+
+def gen_escaped(n):
+    lines = ["messages:"]
+    for i in range(n):
+        lines.append("  - \"line {}\\tcol\\n\\\"quoted\\\" \\u00e9\\x41\"".format(i))
+    return "\n".join(lines) + "\n"
+
+
+def gen_wide(n):
+    lines = []
+    for i in range(n):
+        lines.append("key_{}: {}".format(i, i))
+        lines.append("\"quoted_{}\": \"{}\"".format(i, i))
+    return "\n".join(lines) + "\n"
+
+
+def gen_wide_flow(n):
+    items = []
+    for i in range(n):
+        items.append("key_{}: {}".format(i, i))
+        items.append("\"quoted_{}\": \"{}\"".format(i, i))
+    return "{\n  " + ",\n  ".join(items) + "\n}\n"
+
+
+def gen_deep(n):
+    # n maps, each nested 32 levels deep, half indented and half in flow style
+    depth = 32
+    lines = []
+    for i in range(n):
+        lines.append("item_{}:".format(i))
+        for d in range(1, depth // 2):
+            lines.append("{}level_{}:".format("  " * d, d))
+        lines.append("{}leaf: {}{}{}".format("  " * (depth // 2), "[" * (depth // 2), i, "]" * (depth // 2)))
+    return "\n".join(lines) + "\n"
+
+
+def gen_list(n):
+    lines = ["items:"]
+    for i in range(n * 5):
+        lines.append("  - {}".format(i * 7))
+    return "\n".join(lines) + "\n"
+
+
+def gen_comments(n):
+    lines = ["# generated configuration", "#" * 60]
+    for i in range(n):
+        lines.append("# section {}: this comment explains the setting below it".format(i))
+        lines.append("setting_{}: {}  # trailing comment".format(i, i))
+        lines.append("")
+        lines.append("    # an indented comment, followed by a blank line")
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def gen_json(n):
+    # flow style, and valid JSON, so json.loads can read it too
+    items = []
+    for i in range(n):
+        items.append('"service_{}": {{"host": "host-{}.example.com", "port": {}, "enabled": true, '
+                     '"tags": ["a", "b", "c"], "limits": {{"cpu": 0.5, "memory": 512}}}}'.format(i, i, 8000 + i))
+    return "{\n  " + ",\n  ".join(items) + "\n}\n"
+
+
+def gen_unfixed(n):
+    # problems that --fix repairs: unquoted strings, and no space after ':'
+    lines = []
+    for i in range(n):
+        lines.append("service_{}:".format(i))
+        lines.append("  host: host-{}.example.com".format(i))
+        lines.append("  port:{}".format(8000 + i))
+        lines.append("  limits: {cpu:0.5, memory:512}")
+    return "\n".join(lines) + "\n"
+
+
+CORPORA = [
+    # name, generator, whether json.loads can read it
+    ("config", gen_config, False),
+    ("config (json)", gen_json, True),
+    ("wide map", gen_wide, False),
+    ("wide flow map", gen_wide_flow, False),
+    ("deep", gen_deep, False),
+    ("long list", gen_list, False),
+    ("plain strings", gen_strings, False),
+    ("escaped strings", gen_escaped, False),
+    ("comments", gen_comments, False),
+]
+
+FIX_OPTIONS = [
+    ("fix_unquoted", dict(fix_unquoted=True)),
+    ("fix_nospace", dict(fix_nospace=True)),
+    ("force_string_keys", dict(force_string_keys=True)),
+    ("force_commas", dict(force_commas=True)),
+    ("--fix", dict(fix_unquoted=True, fix_nospace=True)),
+]
+
+# seconds per call, by "benchmark: name", saved with --save
+timings = collections.OrderedDict()
+section = None
+
+
+def run(name, fn, buf, number):
+    t = min(timeit.repeat(fn, number=number, repeat=3)) / number
+    print("{:<32} {:>10.2f} ms {:>10.2f} MB/s".format(
+        name, t * 1000, len(buf) / t / 1e6))
+    timings["{}: {}".format(section, name)] = t
+    return t
+
+
+def bench_output(size, number):
+    buf = gen_config(size)
+    with_output = run("parse (with output)",
+                      lambda: safeyaml.parse(buf, output=io.StringIO()), buf, number)
+    without_output = run("parse (no output)",
+                         lambda: safeyaml.parse(buf), buf, number)
+    print("{:<32} {:>10.2f}x".format("speedup", with_output / without_output))
+
+
+def bench_strings(size, number):
+    for name, gen in (("plain strings", gen_strings), ("escaped strings", gen_escaped)):
+        buf = gen(size)
+        run(name, lambda: safeyaml.parse(buf), buf, number)
+
+
+def bench_keys(size, number):
+    for name, gen in (("wide map", gen_wide), ("wide flow map", gen_wide_flow)):
+        buf = gen(size * 5)
+        run(name, lambda: safeyaml.parse(buf), buf, number)
+
+
+def bench_events(size, number):
+    for name, gen in (("config", gen_config), ("wide map", gen_wide), ("wide flow map", gen_wide_flow)):
+        buf = gen(size)
+        run("{} (events)".format(name),
+            lambda: collections.deque(safeyaml.iter_events(buf), maxlen=0), buf, number)
+        run("{} (parse)".format(name),
+            lambda: safeyaml.parse(buf), buf, number)
+
+
+def bench_extract(size, number):
+    buf = gen_config(size)
+    path = ["service_{}".format(size // 2), "tags"]
+    run("parse", lambda: safeyaml.parse(buf)[0][path[0]][path[1]], buf, number)
+    run("extract {}".format(".".join(path)), lambda: safeyaml.extract(buf, path), buf, number)
+
+
+def bench_dump(size, number):
+    obj = safeyaml.parse(gen_config(size))[0]
+    buf = safeyaml.dumps(obj)
+    run("dumps", lambda: safeyaml.dumps(obj), buf, number)
+    run("dumps (flow)", lambda: safeyaml.dumps(obj, flow=True), buf, number)
+    run("json.dumps", lambda: json.dumps(obj), buf, number)
+    if yaml is not None:
+        run("yaml.safe_dump", lambda: yaml.safe_dump(obj, sort_keys=False), buf, number)
+
+
+def bench_json(size, number):
+    buf = gen_config(size)
+    run("write_json", lambda: safeyaml.write_json(buf, io.StringIO()), buf, number)
+    run("parse + json.dump", lambda: json.dump(safeyaml.parse(buf), io.StringIO()), buf, number)
+
+
+def bench_corpus(size, number):
+    for name, gen, is_json in CORPORA:
+        buf = gen(size)
+        run(name, lambda: safeyaml.parse(buf), buf, number)
+        run("{} (with output)".format(name), lambda: safeyaml.parse(buf, output=io.StringIO()), buf, number)
+        if is_json:
+            run("{} (json.loads)".format(name), lambda: json.loads(buf), buf, number)
+        if yaml is not None:
+            run("{} (yaml.safe_load)".format(name), lambda: yaml.safe_load(buf), buf, 1)
+
+
+def bench_options(size, number):
+    buf = gen_config(size)
+    run("no options", lambda: safeyaml.parse(buf, output=io.StringIO()), buf, number)
+    for name, kwargs in FIX_OPTIONS:
+        options = safeyaml.Options(**kwargs)
+        run(name, lambda: safeyaml.parse(buf, output=io.StringIO(), options=options), buf, number)
+
+    buf = gen_unfixed(size)
+    options = safeyaml.Options(fix_unquoted=True, fix_nospace=True)
+    run("--fix (with fixes)", lambda: safeyaml.parse(buf, output=io.StringIO(), options=options), buf, number)
+
+
+BENCHMARKS = {
+    'corpus': bench_corpus,
+    'dump': bench_dump,
+    'events': bench_events,
+    'extract': bench_extract,
+    'json': bench_json,
+    'keys': bench_keys,
+    'options': bench_options,
+    'output': bench_output,
+    'strings': bench_strings,
+}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, threshold):
+    "Print the change in each timing against a --save'd baseline, returning the names of any regressions"
+    slower = []
+    print("-- compared with {}".format(baseline.get("revision") or "baseline"))
+    for name, t in timings.items():
+        if name not in baseline["timings"]:
+            continue
+        ratio = t / baseline["timings"][name]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            slower.append(name)
+        print("{:<48} {:>8.2f}x{}".format(name, ratio, flag))
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="SafeYAML benchmarks",
+        epilog="To check a change for regressions, run with --save base.json before it, and --compare base.json after")
+    parser.add_argument("bench", nargs="*", default=sorted(BENCHMARKS),
+                        help="benchmarks to run: {}".format(", ".join(sorted(BENCHMARKS))))
+    parser.add_argument("--size", type=int, default=2000,
+                        help="number of items in generated documents")
+    parser.add_argument("--number", type=int, default=5,
+                        help="iterations per timing")
+    parser.add_argument("--save", metavar="FILE",
+                        help="write the timings to FILE as JSON")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare the timings with a file written by --save, failing on regressions")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="how much slower counts as a regression, i.e 0.1 for 10%%")
+    args = parser.parse_args()
+
+    for name in args.bench:
+        if name not in BENCHMARKS:
+            print("unknown benchmark: {}".format(name), file=sys.stderr)
+            sys.exit(-1)
+
+    for name in args.bench:
+        print("--", name)
+        section = name
+        BENCHMARKS[name](args.size, args.number)
+
+    if args.save:
+        with open(args.save, "w") as fh:
+            json.dump({
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "size": args.size,
+                "number": args.number,
+                "timings": timings,
+            }, fh, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        if (baseline["size"], baseline["number"]) != (args.size, args.number):
+            print("warning: baseline was run with --size {} --number {}".format(
+                baseline["size"], baseline["number"]), file=sys.stderr)
+        if compare(baseline, args.threshold):
+            sys.exit(1)
@@ -1,21 +1,43 @@
 #!/usr/bin/env python3
 
 import io
+import os
+import copy
 import re
 import sys
+import glob
 import json
+import mmap
+import marshal
+import stat
+import time
+import bisect
+import hashlib
 import argparse
+import tempfile
+import threading
+import itertools
+import concurrent.futures
 
 from collections import OrderedDict
 
-whitespace = re.compile(r"(?:\ |\t|\r|\n)+")
-
 comment = re.compile(r"(#[^\r\n]*(?:\r?\n|$))+")
-import sys
+
+# whitespace and comments, each run of comments preceeded by whitespace
+whitespace_comments = re.compile(r"(?:[\ \t\r\n]+(?:#[^\r\n]*(?:\r?\n|$))*)*")
+
+# blank or comment lines (1), then the indentation of the next line (2), or a comment at the end (3)
+indentation = re.compile(r"((?:\ *(?:#[^\r\n]*)?[\r\n])*)(\ *)(#[^\r\n]*)?")
+
+# an indented map on the rest of the line, i.e '- a: 1'
+inline_map = re.compile(r"[^\r\n]*?: ")
 
 int_b10 = re.compile(r"\d[\d]*")
 flt_b10 = re.compile(r"\.[\d]+")
-exp_b10 = re.compile(r"[eE](?:\+|-)?[\d+]")
+exp_b10 = re.compile(r"[eE](?:\+|-)?\d+")
+
+# numbers that can be copied into JSON as they are
+json_number = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
 
 string_dq = re.compile(
     r'"(?:[^"\\\n\x00-\x1F\uD800-\uDFFF]|\\(?:[\'"\\/bfnrt]|x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}))*"')
@@ -26,9 +48,12 @@ identifier = re.compile(r"(?!\d)[\w\.]+")
 barewords = re.compile(
     r"(?!\d)(?:(?![\r\n#$@%`,:\"\|'\[\]\{\}\&\*\?\<\>]).|:[^\r\n\s])*")
 
-key_name = re.compile("(?:{}|{}|{})".format(
+key_name = re.compile("(?P<dq>{})|(?P<sq>{})|(?P<ident>{})".format(
     string_dq.pattern, string_sq.pattern, identifier.pattern))
 
+escape_seq = re.compile(
+    r"\\(?:x([0-9a-fA-F]{2})|u([0-9a-fA-F]{4})|U([0-9a-fA-F]{8})|(.))")
+
 str_escapes = {
     'b': '\b',
     'n': '\n',
@@ -45,27 +70,71 @@ builtin_names = {'null': None, 'true': True, 'false': False}
 
 reserved_names = set("y|n|yes|no|on|off".split("|"))
 
-newlines = re.compile(r'\r?\n')  # Todo: unicode
+# bare keys that YAML reads as a float, like .5 or .inf
+yaml_float_key = re.compile(r"[-+]?\.(?:[0-9]|(?:inf|nan)$)")
+
+# json's string encoders, without escaping non-ascii characters, and with, as --json writes them
+encode_basestring = json.encoder.encode_basestring
+encode_basestring_ascii = json.encoder.encode_basestring_ascii
+
+# characters YAML won't take unescaped in a string, or that SafeYAML rejects outright
+yaml_escapes = re.compile("[\x7f-\x9f\u2028\u2029\ufeff\ufffe\uffff\ud800-\udfff]")
+surrogates = re.compile("[\ud800-\udfff]")
+
+lines = re.compile(r"[^\n]*\n|[^\n]+")
+
+# a line without any content: blank, a comment, or a '---' separator
+separator_line = re.compile(r"(?:---)?\ *(?:#[^\r\n]*)?[\r\n]*$")
+
+document_start = re.compile(r"^---", re.M)
+
+# text in a flow map or list, up to the next string, comment, bracket, comma or newline
+flow_text = re.compile(r"[^\"'#\[\]{},\n]*")
+
+line_indent = re.compile(r"\ *")
 
 
 def get_position(buf, pos):
-    "Given a new offset, find the next position"
-    line = 1
-    line_off = 0
-    for match in newlines.finditer(buf, 0, pos):
-        line += 1
-        line_off = match.end()
-
-    col = (pos - line_off) + 1
+    "Given an offset, find the (line, col), for one-off lookups"
+    line = buf.count('\n', 0, pos) + 1
+    col = pos - buf.rfind('\n', 0, pos)
     return line, col
 
 
+class LineIndex:
+    "A table of line starts, for mapping many offsets in one buffer to (line, col)"
+
+    def __init__(self, buf):
+        starts = [0]
+        pos = buf.find('\n')
+        while pos != -1:
+            pos += 1
+            starts.append(pos)
+            pos = buf.find('\n', pos)
+        self.starts = starts
+
+    def position(self, pos):
+        line = bisect.bisect_right(self.starts, pos)
+        return line, pos - self.starts[line - 1] + 1
+
+
 class Options:
-    def __init__(self, fix_unquoted=False, fix_nospace=False, force_string_keys=False, force_commas=False):
+    def __init__(self, fix_unquoted=False, fix_nospace=False, force_string_keys=False, force_commas=False, dict_type=dict,
+                 max_depth=256, max_size=64 * 1024 * 1024, max_items=1000000, max_string_length=1024 * 1024,
+                 schema=None):
         self.fix_unquoted = fix_unquoted
         self.fix_nospace = fix_nospace
         self.force_string_keys = force_string_keys
         self.force_commas = force_commas
+        self.dict_type = dict_type  # what to build maps with, i.e OrderedDict
+
+        # Limits for untrusted input, None for unlimited
+        self.max_depth = max_depth
+        self.max_size = max_size
+        self.max_items = max_items
+        self.max_string_length = max_string_length
+
+        self.schema = schema  # a Schema to check each document against while parsing
 
 
 class ParserErr(Exception):
@@ -75,9 +144,17 @@ class ParserErr(Exception):
     def explain(self):
         return self.reason
 
+    def position(self, index=None):
+        if index is not None:
+            line, col = index.position(self.pos)
+        else:
+            line, col = get_position(self.buf, self.pos)
+        return line + self.line_offset, col
+
     def __init__(self, buf, pos, reason=None):
         self.buf = buf
         self.pos = pos
+        self.line_offset = 0  # lines before buf, when buf is one document of a stream
         if reason is None:
             nl = buf.rfind(' ', pos - 10, pos)
             if nl < 0:
@@ -100,6 +177,30 @@ class ReservedKey(SemanticErr):
     pass
 
 
+class SchemaErr(SemanticErr):
+    pass
+
+
+class LimitExceeded(SemanticErr):
+    pass
+
+
+class TooLarge(LimitExceeded):
+    pass
+
+
+class TooDeep(LimitExceeded):
+    pass
+
+
+class TooManyItems(LimitExceeded):
+    pass
+
+
+class StringTooLong(LimitExceeded):
+    pass
+
+
 class SyntaxErr(ParserErr):
     pass
 
@@ -144,337 +245,1148 @@ class UnsupportedEscape(ParserErr):
     pass
 
 
-def parse(buf, output=None, options=None):
-    if not buf:
-        raise NoRootObject(buf, 0, "Empty Document")
+def parse(buf, output=None, options=None, edits=None):
+    """Parse every document in buf, writing the (fixed) text to output if given
+
+    buf is a str, or UTF-8 bytes, memoryview or mmap. See as_text().
+    Changes made by the fix options are appended to edits if given, as
+    a sorted list of (offset, delete_len, insert_text). See apply_edits()."""
+    if output is not None and edits is None:
+        edits = []
+
+    buf = as_text(buf)
+    out = list(parse_documents(buf, edits, options or Options()))
+
+    if output is not None:
+        output.write(apply_edits(buf, edits))
+    return out
+
 
-    output = output or io.StringIO()
+def iter_parse(source, options=None):
+    """Parse a string or file object, yielding each '---' separated document as soon as it is parsed
+
+    A file or mmap is read a line at a time, and only the current document is
+    kept in memory, so max_size applies to each document rather than the whole
+    file. Binary files are decoded as UTF-8. The documents and errors are the
+    same as parse() would give. See read_documents()."""
+    options = options or Options()
+    for buf, line_offset, events in read_documents(source, options):
+        try:
+            if options.schema is not None:
+                yield from options.schema.build(buf, events, options.dict_type)
+            else:
+                yield from build(events, options.dict_type)
+        except ParserErr as p:
+            p.line_offset = line_offset
+            raise
+
+
+def read_documents(source, options):
+    """Yield (buf, line_offset, events) for each document in a file, or for the whole of a string
+
+    At each line starting with '---', the text before it is parsed as a
+    document, and it is only split off if the parser stops right before
+    that line, in which case it is parsed again for the caller. Otherwise, the '---' doesn't end the document for parse()
+    either, and the rest of the file is read and parsed in one go."""
+    if isinstance(source, mmap.mmap):
+        source = iter(source.readline, b"")
+    elif not hasattr(source, 'read'):
+        buf = as_text(source)
+        yield buf, 0, document_events(buf, None, options)
+        return
+
+    # after a split, buf starts with the '---' that ended the document before it
+    lines, line_offset, start, content, split = io.StringIO(), 0, 0, False, True
+    for line in itertools.chain(source, [None]):
+        if line is None:
+            buf = lines.getvalue()
+            yield buf, line_offset, document_events(buf, None, options, start=start)
+            return
+        if line.__class__ is not str:
+            line = str(line, 'utf-8')
+
+        if split and content and line.startswith('---'):
+            buf = lines.getvalue() + line
+            end = len(buf) - len(line)
+            if options.max_size is not None and end > options.max_size:
+                yield buf, line_offset, document_events(buf[:end], None, options, start=start)
+                return
+            # only whether the parser stops there is kept, and the document is parsed again when it's read
+            document = parse_document(buf, start, None, options)
+            try:
+                while True:
+                    next(document)
+            except StopIteration as done:
+                split = done.value == end
+            except ParserErr:
+                split = False
+            if split:
+                yield buf, line_offset, parse_document(buf, start, None, options)
+                line_offset += buf.count('\n', 0, end)
+                lines, start, content = io.StringIO(), 3, False
+
+        if not start and not lines.tell() and line.startswith("\uFEFF"):
+            start = 1
+        lines.write(line)
+        content = content or not separator_line.match(line)
+
+
+def parse_documents(buf, edits, options):
+    "Yield each '---' separated document in buf"
+    events = document_events(buf, edits, options)
+    if options.schema is not None:
+        return options.schema.build(buf, events, options.dict_type)
+    return build(events, options.dict_type)
+
+
+def parse_recover(buf, options=None):
+    """Parse every document in buf, carrying on past errors, returning (objects, errors)
+
+    Every error is found in one pass, and the objects are built from what
+    could be parsed, with None for any value that couldn't. Each error is
+    a ParserErr, in the order they were found."""
     options = options or Options()
-    pos = 1 if buf.startswith("\uFEFF") else 0
+    buf = as_text(buf)
+    errors = []
+    events = document_events(buf, None, options, errors)
+    if options.schema is not None:
+        out = list(options.schema.build(buf, events, options.dict_type, errors))
+    else:
+        out = list(build(events, options.dict_type))
+    return out, errors
+
+
+def iter_events(buf, options=None):
+    """Parse every document in buf, yielding (event, start, end, value) tuples without building any objects
+
+    Each document is a START_MAP or START_LIST event, followed by a KEY event
+    before each value in a map, and SCALAR events or nested structures for the
+    values, up to the matching END_MAP or END_LIST. The start and end of each
+    event are the offsets of its source text: a key, a scalar, or a bracket."""
+    return document_events(buf, None, options or Options())
+
+
+def extract(buf, path, options=None):
+    """Parse buf, but only build the value at path in the first document, raising KeyError if it is missing
+
+    The path is a list of map keys and list indexes. Everything else is
+    checked as usual, but skipped without building any objects."""
+    options = options or Options()
+    events = document_events(buf, None, options)
+    event, start, end, value = next(events)
+    found = False
+
+    for step in path:
+        if event == START_MAP and isinstance(step, str):
+            event, start, end, value = next(events)
+            while event == KEY and value != step:
+                event, start, end, value = next(events)
+                if event != SCALAR:
+                    events.send(True)
+                event, start, end, value = next(events)
+            if event == END_MAP:
+                break
+            event, start, end, value = next(events)
+        elif event == START_LIST and isinstance(step, int) and not isinstance(step, bool) and step >= 0:
+            event, start, end, value = next(events)
+            for i in range(step):
+                if event == END_LIST:
+                    break
+                if event != SCALAR:
+                    events.send(True)
+                event, start, end, value = next(events)
+            if event == END_LIST:
+                break
+        else:
+            if event != SCALAR:
+                events.send(True)
+            break
+    else:
+        found = True
+        if event == SCALAR:
+            obj = value
+        else:
+            obj = next(build(itertools.chain([(event, start, end, value)], events), options.dict_type))
+
+    # check the rest of the document, and any documents after it
+    for event, start, end, value in events:
+        if event == START_MAP or event == START_LIST:
+            events.send(True)
+
+    if not found:
+        raise KeyError(path)
+    return obj
+
+
+def document_events(buf, edits, options, errors=None, start=0):
+    """Yield the events for each '---' separated document in buf
+
+    If errors is a list, errors are appended to it instead of raised, and
+    the parser carries on as best it can. See recover_events(). Parsing
+    starts at start, i.e after a '---' that ended an earlier document."""
+    buf = as_text(buf)
+    err = None
+    if not buf:
+        err = NoRootObject(buf, 0, "Empty Document")
+    elif options.max_size is not None and len(buf) > options.max_size:
+        err = TooLarge(buf, options.max_size, "Document too large: found more than {} characters".format(options.max_size))
+    if err is not None:
+        if errors is None:
+            raise err
+        errors.append(err)
+        return
+
+    pos = start
+    if not pos and buf.startswith("\uFEFF"):
+        pos = 1
+        if edits is not None:
+            edits.append((0, 1, ''))
 
-    out = []
     while pos != len(buf):
-        obj, pos = parse_document(buf, pos, output, options)
-        out.append(obj)
+        pos = yield from parse_document(buf, pos, edits, options, errors)
 
         if buf[pos:pos+3] == '---':
-            output.write(buf[pos:pos+3])
             pos += 3
         elif pos < len(buf):
-            raise TrailingContent(buf, pos, "Trailing content: {}".format(
+            err = TrailingContent(buf, pos, "Trailing content: {}".format(
                 repr(buf[pos:pos + 10])))
+            if errors is None:
+                raise err
+            errors.append(err)
+            m = document_start.search(buf, pos)
+            pos = m.start() if m else len(buf)
 
-    return out
 
-def parse_document(buf, pos, output, options):
-    obj, pos = parse_structure(buf, pos, output, options, at_root=True)
+def as_text(buf):
+    """Return buf as a str, decoding bytes, memoryview or mmap input as UTF-8
 
-    start = pos
-    m = whitespace.match(buf, pos)
-    while m:
-        pos = m.end()
-        m = comment.match(buf, pos)
-        if m:
-            pos = m.end()
-            m = whitespace.match(buf, pos)
-    output.write(buf[start:pos])
-    return obj, pos
+    The buffer is decoded in one go, without copying it into bytes first.
+    Offsets in events, errors, and edits are in characters of the text."""
+    if buf.__class__ is str:
+        return buf
+    return str(buf, 'utf-8')
 
 
-def peek_line(buf,pos):
-    start = pos
-    while pos < len(buf):
-        peek = buf[pos]
-        if peek in ('\r','\n'): break
-        pos +=1
-    return buf[start:pos]
+def apply_edits(buf, edits):
+    "Apply a sorted list of (offset, delete_len, insert_text) edits to buf"
+    out = []
+    pos = 0
+    for offset, length, text in edits:
+        out.append(buf[pos:offset])
+        out.append(text)
+        pos = offset + length
+    out.append(buf[pos:])
+    return "".join(out)
+
+
+def format_diff(buf, edits, filename, context=3):
+    "Format a sorted list of edits to buf as a unified diff, only looking at the lines around each edit"
+    if not edits:
+        return ""
+
+    # fixes never add or remove newlines, so each changed line maps to one new line
+    starts = LineIndex(buf).starts
+    if starts[-1] == len(buf) and len(starts) > 1:
+        starts.pop()
+    count = len(starts)
+    starts.append(len(buf))
+
+    hunks = []
+    for edit in edits:
+        offset, length, text = edit
+        first = bisect.bisect_right(starts, offset, 0, count) - 1
+        last = bisect.bisect_right(starts, offset + length, 0, count) - 1
+        lo, hi = max(0, first - context), min(count, last + 1 + context)
+        if hunks and lo <= hunks[-1][1]:
+            hunks[-1][1] = max(hi, hunks[-1][1])
+            hunks[-1][2].append(edit)
+        else:
+            hunks.append([lo, hi, [edit]])
+
+    out = ["--- {}\n".format(filename), "+++ {}\n".format(filename)]
+    for lo, hi, hunk_edits in hunks:
+        start, end = starts[lo], starts[hi]
+        old = buf[start:end]
+        new = apply_edits(old, [(offset - start, length, text) for offset, length, text in hunk_edits])
+        old_lines, new_lines = lines.findall(old), lines.findall(new)
+
+        span = "{},{}".format(lo + 1, len(old_lines)) if len(old_lines) != 1 else str(lo + 1)
+        out.append("@@ -{} +{} @@\n".format(span, span))
+        diff, i = [], 0
+        while i < len(old_lines):
+            if old_lines[i] == new_lines[i]:
+                diff.append(" " + old_lines[i])
+                i += 1
+                continue
+            j = i
+            while j < len(old_lines) and old_lines[j] != new_lines[j]:
+                j += 1
+            diff.extend("-" + line for line in old_lines[i:j])
+            diff.extend("+" + line for line in new_lines[i:j])
+            i = j
+        for line in diff:
+            out.append(line if line.endswith('\n') else line + "\n\\ No newline at end of file\n")
+    return "".join(out)
+
+
+def parse_document(buf, pos, edits, options, errors=None):
+    "Yield the events for the document at pos, returning the offset after it"
+    if errors is None:
+        try:
+            pos = yield from parse_events(buf, pos, edits, options)
+        except IndexError:
+            # the grammar reads past the end of a truncated document
+            raise SyntaxErr(buf, len(buf), "Unexpected end of file") from None
+    else:
+        pos = yield from recover_events(buf, pos, edits, options, errors)
+
+    return skip_whitespace(buf, pos)
 
 
 def move_to_next(buf, pos):
-    line_pos = pos
-    next_line = False
-    while pos < len(buf):
-        peek = buf[pos]
+    "Skip spaces, newlines, and comments, returning (pos, indent, next_line)"
+    m = indentation.match(buf, pos)
+    line_pos = m.end(1)
+    end = m.end()
+    return end, m.end(2) - line_pos, line_pos != pos or end != m.end(2)
 
-        if peek == ' ':
-            pos += 1
-        elif peek == '\n' or peek == '\r':
-            pos += 1
-            line_pos = pos
-            next_line = True
-        elif peek == '#':
-            next_line = True
-            while pos < len(buf):
-                pos += 1
-                if buf[pos] == '\r' or buf[pos] == '\n':
-                    line_pos = pos
-                    next_line = True
-                    break
-        else:
-            break
-    return pos, pos - line_pos, next_line
 
+def skip_whitespace(buf, pos):
+    return whitespace_comments.match(buf, pos).end()
 
-def skip_whitespace(buf, pos, output):
-    m = whitespace.match(buf, pos)
-    while m:
-        output.write(buf[pos:m.end()])
-        pos = m.end()
-        m = comment.match(buf, pos)
-        if m:
-            output.write(buf[pos:m.end()])
-            pos = m.end()
-            m = whitespace.match(buf, pos)
-    return pos
 
+# Events produced by parse_events(), as (event, start, end, value) tuples, where start
+# and end are the offsets of the source text for the event, empty for an indented structure
 
-def parse_structure(buf, pos, output, options, indent=0, at_root=False):
-    while True:
-        start = pos
-        pos, my_indent, next_line = move_to_next(buf, pos)
+START_MAP, END_MAP, START_LIST, END_LIST, KEY, SCALAR = 'start_map', 'end_map', 'start_list', 'end_list', 'key', 'scalar'
 
-        if my_indent < indent:
-            raise BadIndent(
-                buf, pos, "The parser has gotten terribly confused, I'm sorry. Try re-indenting")
+# Frames on the stack of parse_events, and the tasks it can start
 
-        output.write(buf[start:pos])
-        peek = buf[pos]
+MAP, LIST, INDENTED_MAP, INDENTED_LIST, VALUE, STRUCTURE, RESUME = range(7)
 
-        if peek in ('*', '&', '?', '|', '<', '>', '%', '@'):
-            raise UnsupportedYAML(
-                buf, pos, "I found a {} outside of quotes. It's too special to let pass. Anchors, References, and other directives are not valid SafeYAML, Sorry.".format(peek))
 
-        if peek == '-' and buf[pos:pos + 3] == '---':
-            output.write(buf[pos:pos+3])
-            pos += 3
-            continue
-        break
+def parse_events(buf, pos, edits, options, stack=None):
+    """Parse one root structure, yielding events and returning the end offset
 
-    if peek == '-':
-        return parse_indented_list(buf, pos, output, options, my_indent)
+    The parser keeps an explicit stack instead of recursing, so there is no
+    limit on nesting other than options.max_depth. Given a non-empty stack,
+    it carries on with the frame on top, as if a value had just ended at pos.
 
-    m = key_name.match(buf, pos)
+    Sending a true value in reply to a START_MAP or START_LIST event skips
+    that structure: it is still checked, but no events are yielded for its
+    contents, and the next event is the matching END_MAP or END_LIST."""
+    max_depth, max_items = options.max_depth, options.max_items
+    if stack is None:
+        stack = []
+    skip = None  # the depth of the structure being skipped
+    task, indent, at_root, m = STRUCTURE if not stack else RESUME, 0, True, None
 
-    if peek == '"' or peek == '"' or m:
-        return parse_indented_map(buf, pos, output, options, my_indent, at_root)
+    while True:
+        # Start parsing a value or structure: either we get a scalar,
+        # or a new frame is pushed onto the stack.
 
-    if peek == '{':
-        if at_root:
-            return parse_map(buf, pos, output, options)
-        else:
-            raise BadIndent(
-                buf, pos, "Expected an indented object or indented list, but found {} on next line")
-    if peek == '[':
-        if at_root:
-            return parse_list(buf, pos, output, options)
-        else:
-            raise BadIndent(
-                buf, pos, "Expected an indented object or indented list, but found [] on next line")
+        if task == VALUE:
+            pos = skip_whitespace(buf, pos)
 
-    if peek in "+-0123456789":
-        if at_root:
-            raise NoRootObject(
-                buf, pos, "No root object found: expected object or list, found start of number")
-        else:
-            raise BadIndent(
-                buf, pos, "Expected an indented object or indented list, but found start of number on next line.")
+            peek = buf[pos]
 
-    raise SyntaxErr(
-        buf, pos, "The parser has become terribly confused, I'm sorry")
+            if peek in ('*', '&', '?', '|', '<', '>', '%', '@'):
+                raise UnsupportedYAML(
+                    buf, pos, "I found a {} outside of quotes. It's too special to let pass. Anchors, References, and other directives are not valid SafeYAML, Sorry.".format(peek))
 
+            if peek == '-' and buf[pos:pos + 3] == '---':
+                raise UnsupportedYAML(
+                    buf, pos, "A SafeYAML document is a single document, '---' separators are unsupported")
 
-def parse_indented_list(buf, pos, output, options, my_indent):
-    out = []
-    while pos < len(buf):
-        if buf[pos] != '-':
-            break
-        output.write("-")
-        pos += 1
-        if buf[pos] not in (' ', '\r', '\n'):
-            raise BadKey(
-                buf, pos, "For indented lists i.e '- foo', the '-'  must be followed by ' ', or '\n', not: {}".format(buf[pos - 1:pos + 1]))
+            if peek == '{':
+                task = MAP
+            elif peek == '[':
+                task = LIST
+            else:
+                start = pos
+                if peek == "'" or peek == '"':
+                    obj, pos = parse_string(buf, pos, edits, options, skip is None)
+                elif peek in "-+0123456789":
+                    obj, pos = parse_number(buf, pos, edits, options)
+                else:
+                    obj, pos = parse_bareword(buf, pos, edits, options)
+                if skip is None:
+                    yield SCALAR, start, pos, obj
+
+        elif task == STRUCTURE:
+            while True:
+                pos, my_indent, next_line = move_to_next(buf, pos)
+
+                if my_indent < indent:
+                    raise BadIndent(
+                        buf, pos, "The parser has gotten terribly confused, I'm sorry. Try re-indenting")
+
+                peek = buf[pos]
+
+                if peek in ('*', '&', '?', '|', '<', '>', '%', '@'):
+                    raise UnsupportedYAML(
+                        buf, pos, "I found a {} outside of quotes. It's too special to let pass. Anchors, References, and other directives are not valid SafeYAML, Sorry.".format(peek))
+
+                if peek == '-' and buf[pos:pos + 3] == '---':
+                    pos += 3
+                    continue
+                break
+
+            indent = my_indent
+            m = None if peek == '-' else key_name.match(buf, pos)
+            if peek == '-':
+                task = INDENTED_LIST
+            elif peek == '"' or m:
+                task = INDENTED_MAP
+            elif peek == '{':
+                if at_root:
+                    task = MAP
+                else:
+                    raise BadIndent(
+                        buf, pos, "Expected an indented object or indented list, but found {} on next line")
+            elif peek == '[':
+                if at_root:
+                    task = LIST
+                else:
+                    raise BadIndent(
+                        buf, pos, "Expected an indented object or indented list, but found [] on next line")
+            elif peek in "+-0123456789":
+                if at_root:
+                    raise NoRootObject(
+                        buf, pos, "No root object found: expected object or list, found start of number")
+                else:
+                    raise BadIndent(
+                        buf, pos, "Expected an indented object or indented list, but found start of number on next line.")
+            else:
+                raise SyntaxErr(
+                    buf, pos, "The parser has become terribly confused, I'm sorry")
+
+        started = task != VALUE and task != RESUME
+        if started:
+            if max_depth is not None and len(stack) >= max_depth:
+                raise TooDeep(buf, pos, "Too deeply nested: found more than {} levels of maps and lists".format(max_depth))
+
+            event = START_LIST if task == INDENTED_LIST or task == LIST else START_MAP
+            end = pos if task == INDENTED_MAP or task == INDENTED_LIST else pos + 1
+            if skip is None and (yield event, pos, end, None):
+                skip = len(stack)
+
+            if task == INDENTED_MAP:
+                if m is None:
+                    m = key_name.match(buf, pos)
+                stack.append([INDENTED_MAP, set(), indent, at_root, m])
+            elif task == INDENTED_LIST:
+                stack.append([INDENTED_LIST, 0, indent])
+            elif task == MAP:
+                pos = skip_whitespace(buf, pos + 1)
+                stack.append([MAP, set(), None])
+            else:
+                pos = skip_whitespace(buf, pos + 1)
+                stack.append([LIST, 0, None])
+
+        # Either start the frame just pushed, or carry on with the frame on
+        # top of the stack after the value that just finished. Then, find
+        # out what to parse next, popping any frames that end.
+
+        while True:
+            if not stack:
+                return pos
+
+            frame = stack[-1]
+            kind = frame[0]
+
+            if kind == MAP:
+                keys = frame[1]
+                if not started:
+                    pos = skip_whitespace(buf, pos)
+
+                    peek = buf[pos]
+                    frame[2] = False
+                    if peek == ',':
+                        pos += 1
+                        frame[2] = True
+                        pos = skip_whitespace(buf, pos)
+                    elif peek != '}':
+                        raise SyntaxErr(
+                            buf, pos, "Expecting a ',', or a '{}' but found {}".format('}', repr(peek)))
+
+                if buf[pos] == '}':
+                    if edits is not None and options.force_commas:
+                        if keys and frame[2] == False:
+                            edits.append((pos, 0, ','))
+                    pos += 1
+                    stack.pop()
+                    started = False
+                    if skip is None or len(stack) == skip:
+                        skip = None
+                        yield END_MAP, pos - 1, pos, None
+                    continue
+
+                if max_items is not None and len(keys) >= max_items:
+                    raise TooManyItems(buf, pos, "Too many items: found more than {} keys in one map".format(max_items))
+
+                start = pos
+                key, new_pos, is_bare = parse_key(buf, pos, edits, options)
+
+                if key in keys:
+                    raise DuplicateKey(
+                        buf, pos, "Can't have duplicate keys: {} is defined twice.".format(repr(key)))
+                keys.add(key)
+
+                pos = skip_whitespace(buf, new_pos)
+
+                peek = buf[pos]
+
+                if peek == ':':
+                    pos += 1
+                else:
+                    raise BadKey(
+                        buf, pos, "Expected a ':', when parsing a key: value pair but found {}".format(repr(peek)))
+
+                if is_bare and buf[pos] not in (' ', '\r', '\n'):
+                    if options.fix_nospace:
+                        if edits is not None:
+                            edits.append((pos, 0, ' '))
+                    else:
+                        raise BadKey(buf, pos, "For key {}, expected space or newline after ':', found {}.".format(
+                            repr(key), repr(buf[pos:pos + 10])))
+
+                if skip is None:
+                    yield KEY, start, new_pos, key
+                pos = skip_whitespace(buf, pos)
+                task = VALUE
+                break
+
+            elif kind == LIST:
+                if not started:
+                    frame[1] += 1
+
+                    pos = skip_whitespace(buf, pos)
+
+                    peek = buf[pos]
+                    frame[2] = False
+                    if peek == ',':
+                        frame[2] = True
+                        pos += 1
+                        pos = skip_whitespace(buf, pos)
+                    elif peek != ']':
+                        raise SyntaxErr(
+                            buf, pos, "Inside a [], Expecting a ',', or a ']' but found {}".format(repr(peek)))
+
+                if buf[pos] == ']':
+                    if edits is not None and options.force_commas:
+                        if frame[1] and frame[2] == False:
+                            edits.append((pos, 0, ','))
+                    pos += 1
+                    stack.pop()
+                    started = False
+                    if skip is None or len(stack) == skip:
+                        skip = None
+                        yield END_LIST, pos - 1, pos, None
+                    continue
+
+                if max_items is not None and frame[1] >= max_items:
+                    raise TooManyItems(buf, pos, "Too many items: found more than {} items in one list".format(max_items))
+                task = VALUE
+                break
+
+            elif kind == INDENTED_MAP:
+                keys, my_indent = frame[1], frame[2]
+                if not started:
+                    new_pos, new_indent, next_line = move_to_next(buf, pos)
+                    if not next_line or new_indent != my_indent:
+                        m = None
+                    else:
+                        pos = new_pos
+                        m = key_name.match(buf, pos)
+                else:
+                    m = frame[4]
+
+                if not m:
+                    stack.pop()
+                    started = False
+                    if skip is None or len(stack) == skip:
+                        skip = None
+                        yield END_MAP, pos, pos, None
+                    continue
+
+                if max_items is not None and len(keys) >= max_items:
+                    raise TooManyItems(buf, pos, "Too many items: found more than {} keys in one map".format(max_items))
+                start = pos
+                name, pos, is_bare = parse_key(buf, pos, edits, options, m)
+                end = pos
+                if name in keys:
+                    raise DuplicateKey(
+                        buf, pos, "Can't have duplicate keys: {} is defined twice.".format(repr(name)))
+                keys.add(name)
+
+                if buf[pos] != ':':
+                    if is_bare or not frame[3]:
+                        raise BadKey(buf, pos, "Expected 'key:', but didn't find a ':', found {}".format(
+                            repr(buf[pos:pos + 10])))
+                    else:
+                        raise NoRootObject(
+                            buf, pos, "Expected 'key:', but didn't find a ':', found a string {}. Note that strings must be inside a containing object or list, and cannot be root element".format(repr(buf[pos:pos + 10])))
+
+                pos += 1
+                if buf[pos] not in (' ', '\r', '\n'):
+                    if options.fix_nospace:
+                        if edits is not None:
+                            edits.append((pos, 0, ' '))
+                    else:
+                        raise BadKey(buf, pos, "For key {}, expected space or newline after ':', found {}.".format(
+                            repr(name), repr(buf[pos:pos + 10])))
+
+                new_pos, new_indent, next_line = move_to_next(buf, pos)
+                if next_line and new_indent < my_indent:
+                    raise BadIndent(
+                        buf, new_pos, "Missing value. Found a key, but the line afterwards isn't indented enough to count.")
+
+                if skip is None:
+                    yield KEY, start, end, name
+                if not next_line:
+                    pos = new_pos
+                    task = VALUE
+                else:
+                    pos = new_pos - new_indent
+                    task, indent, at_root = STRUCTURE, my_indent, False
+                break
 
+            else:
+                my_indent = frame[2]
+                if not started:
+                    frame[1] += 1
+
+                    new_pos, new_indent, next_line = move_to_next(buf, pos)
+                    if not (next_line and new_indent == my_indent and buf[new_pos:new_pos+1] == '-'):
+                        stack.pop()
+                        started = False
+                        if skip is None or len(stack) == skip:
+                            skip = None
+                            yield END_LIST, pos, pos, None
+                        continue
+
+                    pos = new_pos
+
+                if max_items is not None and frame[1] >= max_items:
+                    raise TooManyItems(buf, pos, "Too many items: found more than {} items in one list".format(max_items))
+                pos += 1
+                if buf[pos] not in (' ', '\r', '\n'):
+                    raise BadKey(
+                        buf, pos, "For indented lists i.e '- foo', the '-'  must be followed by ' ', or '\n', not: {}".format(buf[pos - 1:pos + 1]))
+
+                new_pos, new_indent, next_line = move_to_next(buf, pos)
+                if next_line and new_indent <= my_indent:
+                    raise BadIndent(
+                        buf, new_pos, "Expecting a list item, but the next line isn't indented enough")
+
+                if not next_line:
+                    if inline_map.match(buf, pos):
+                        task, indent, at_root = INDENTED_MAP, my_indent + 1 + (new_pos - pos), False
+                    else:
+                        task = VALUE
+                    pos = new_pos
+                else:
+                    task, indent, at_root = STRUCTURE, my_indent, False
+                break
+
+
+def recover_events(buf, pos, edits, options, errors, stack=None):
+    """Like parse_events(), but append each ParserErr to errors and carry on
+
+    After an error, the parser skips to the next ',' or bracket in a flow map
+    or list, or to the next line that lines up with an indented map or list,
+    ending any structures it leaves behind. A key left without a value gets
+    None. After trailing content, an indented map or list at the root carries
+    on at the next line that lines up with it, up to the next '---'. Going
+    over a limit still ends the parse. As with parse_events(), a non-empty
+    stack carries on with the frame on top."""
+    if stack is None:
+        stack = []
+    pending = False  # a KEY is waiting for its value
+    last = None
+    root = stack[0] if stack else None
+    held = None  # the end of an indented root, until it's clear the document ends there
+    while True:
+        events = parse_events(buf, pos, edits, options, stack)
+        try:
+            while True:
+                event = next(events)
+                if stack:
+                    root = stack[0]
+                elif root is not None and (root[0] == INDENTED_MAP or root[0] == INDENTED_LIST) and \
+                        (event[0] == END_MAP or event[0] == END_LIST):
+                    held = event
+                    continue
+                pending = event[0] == KEY
+                yield event
+        except StopIteration as done:
+            end = done.value
+            if held is None:
+                return end
+            pos = skip_whitespace(buf, end)
+            if pos < len(buf) and buf[pos:pos+3] != '---':
+                errors.append(TrailingContent(buf, pos, "Trailing content: {}".format(repr(buf[pos:pos + 10]))))
+                end = len(buf)
+                line = buf.find('\n', pos)
+                while line >= 0:
+                    new_pos, new_indent, next_line = move_to_next(buf, line)
+                    if new_pos == len(buf) or (new_indent == 0 and buf[new_pos:new_pos+3] == '---'):
+                        end = new_pos
+                        break
+                    if new_indent == root[2]:
+                        break
+                    line = buf.find('\n', new_pos)
+                if line >= 0 and end == len(buf):
+                    # carry on with the root, from the end of the line before
+                    stack.append(root)
+                    held = None
+                    pos = new_pos - new_indent - 1
+                    continue
+            yield held
+            return end
+        except IndexError:
+            err = SyntaxErr(buf, len(buf), "Unexpected end of file")
+        except ParserErr as e:
+            err = e
+        errors.append(err)
+
+        pos = min(err.pos, len(buf))
+        if pending:
+            yield SCALAR, pos, pos, None
+            pending = False
+        if isinstance(err, LimitExceeded):
+            pos = len(buf)
+        stuck, last = last == (pos, len(stack)), (pos, len(stack))
+        pos = yield from resync(buf, pos, stack, isinstance(err, BadIndent) and not stuck)
+        if not stack:
+            m = document_start.search(buf, pos)
+            return m.start() if m else len(buf)
+
+
+def resync(buf, pos, stack, keep_line):
+    """Skip past an error at pos, yielding END events for the structures left behind, and returning where to carry on
+
+    With keep_line, the error is about the line at pos not being indented
+    enough for what came before, so the line itself is parsed again."""
+    outer = None  # the indent of the innermost indented structure
+    for frame in stack:
+        if frame[0] == INDENTED_MAP or frame[0] == INDENTED_LIST:
+            outer = frame[2]
+
+    while stack:
+        kind = stack[-1][0]
+        if kind == INDENTED_MAP or kind == INDENTED_LIST:
+            break
+        depth = 0
+        line_start = buf.rfind('\n', 0, pos)
+        if outer is not None and line_start >= 0 and not buf[line_start + 1:pos].strip(' '):
+            # the error is at the start of a line, so check it like any other new line
+            pos = line_start
+        while pos < len(buf):
+            pos = flow_text.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            peek = buf[pos]
+            if peek == '"' or peek == "'":
+                m = (string_dq if peek == '"' else string_sq).match(buf, pos)
+                pos = m.end() if m else pos + 1
+            elif peek == '#':
+                pos = buf.find('\n', pos)
+                if pos < 0:
+                    pos = len(buf)
+            elif peek == '\n':
+                new_pos, new_indent, next_line = move_to_next(buf, pos)
+                if outer is not None and new_indent <= outer and buf[new_pos:new_pos + 1] not in ('}', ']'):
+                    # the next line belongs to an indented structure, so the brackets were never closed
+                    keep_line = True
+                    break
+                pos = new_pos
+            elif peek == '[' or peek == '{':
+                depth += 1
+                pos += 1
+            elif depth:
+                if peek != ',':
+                    depth -= 1
+                pos += 1
+            elif peek == ',' or peek == (']' if kind == LIST else '}'):
+                return pos
+            else:
+                break
+
+        # pop the frame on a bracket that doesn't match it, or every flow frame left on a new line
+        while stack and (stack[-1][0] == MAP or stack[-1][0] == LIST):
+            frame = stack.pop()
+            yield (END_MAP if frame[0] == MAP else END_LIST), pos, pos, None
+            if pos < len(buf) and buf[pos] != '\n':
+                break
+
+    if not stack or pos == len(buf):
+        return pos
+
+    top = stack[-1][2]
+    indents = set(frame[2] for frame in stack)
+    line_start = buf.rfind('\n', 0, pos)
+    if buf[pos] == '\n':
+        pass
+    elif keep_line and line_start >= 0 and not buf[line_start + 1:pos].strip(' '):
+        pos = line_start
+    else:
+        pos = buf.find('\n', pos)
+        if pos < 0:
+            return len(buf)
+    # skip any lines that carry on from the error
+    while True:
         new_pos, new_indent, next_line = move_to_next(buf, pos)
-        if next_line and new_indent <= my_indent:
-            raise BadIndent(
-                buf, new_pos, "Expecting a list item, but the next line isn't indented enough")
-
-        if not next_line:
-            output.write(buf[pos:new_pos])
-            line = peek_line(buf,pos)
-            if ': ' in line:
-                new_indent = my_indent + 1 +(new_pos-pos)
-                obj, pos = parse_indented_map(buf, new_pos, output, options, new_indent, at_root=False)
+        if new_pos == len(buf) or (new_indent <= top and new_indent in indents):
+            return pos
+        pos = buf.find('\n', new_pos)
+        if pos < 0:
+            return len(buf)
+
+
+def build(events, dict_type=dict):
+    "Build dicts and lists from a stream of events, yielding each root object as it ends"
+    stack = []
+    top = key = None
+    is_list = False
+    for event, start, end, value in events:
+        if event == SCALAR:
+            if is_list:
+                top.append(value)
+            elif top is not None:
+                top[key] = value
             else:
-                obj, pos = parse_value(buf, new_pos, output, options)
-
+                yield value
+        elif event == KEY:
+            key = value
+        elif event == START_MAP or event == START_LIST:
+            obj = dict_type() if event == START_MAP else []
+            if is_list:
+                top.append(obj)
+            elif top is not None:
+                top[key] = obj
+            stack.append(obj)
+            top, is_list = obj, event == START_LIST
         else:
-            obj, pos = parse_structure(
-                buf, pos, output, options, indent=my_indent)
-
-        out.append(obj)
+            obj = stack.pop()
+            if stack:
+                top = stack[-1]
+                is_list = top.__class__ is list
+            else:
+                top, is_list = None, False
+                yield obj
+
+
+# type name -> (classes it allows, how to describe it)
+SCHEMA_TYPES = {
+    'string': ((str,), "a string"),
+    'int': ((int,), "an int"),
+    'float': ((float,), "a float"),
+    'number': ((int, float), "a number"),
+    'bool': ((bool,), "a bool"),
+    'null': ((type(None),), "null"),
+    'map': ((dict,), "a map"),
+    'list': ((list,), "a list"),
+}
 
-        new_pos, new_indent, next_line = move_to_next(buf, pos)
-        if next_line and new_indent == my_indent and buf[new_pos:new_pos+1] == '-':
-            output.write(buf[pos:new_pos])
-            pos = new_pos
-            continue
+SCHEMA_FOUND = {str: "a string", int: "an int", float: "a float", bool: "a bool",
+                type(None): "null", dict: "a map", list: "a list"}
+
+
+class Schema:
+    """A schema, compiled from a dict, to check documents against as they are parsed
+
+    Every field of the dict is optional:
+
+        type: one of string, int, float, number, bool, null, map, list, or a list of them
+        enum: a list of the allowed values
+        min, max: bounds for a number
+        keys: a map of each key to a schema for its value
+        required: a list of the keys a map must have
+        extra: a schema for the values of keys not in keys, or false to forbid them
+        items: a schema for each item in a list
+
+    Pass it as Options(schema=...), and parse() raises a SchemaErr at the
+    first key or value that doesn't match, as soon as it is parsed."""
+
+    FIELDS = ('type', 'enum', 'min', 'max', 'keys', 'required', 'extra', 'items')
+
+    def __init__(self, spec):
+        if not isinstance(spec, dict):
+            raise ValueError("A schema must be a map, not {!r}".format(spec))
+        unknown = [name for name in spec if name not in self.FIELDS]
+        if unknown:
+            raise ValueError("Unknown schema field {!r}, expected one of: {}".format(unknown[0], ", ".join(self.FIELDS)))
+        self.spec = spec
+
+        self.types = self.expected = None
+        names = spec.get('type')
+        if names is not None:
+            if isinstance(names, str):
+                names = [names]
+            for name in names:
+                if name not in SCHEMA_TYPES:
+                    raise ValueError("Unknown schema type {!r}, expected one of: {}".format(name, ", ".join(SCHEMA_TYPES)))
+            self.types = frozenset(cls for name in names for cls in SCHEMA_TYPES[name][0])
+            self.expected = " or ".join(SCHEMA_TYPES[name][1] for name in names)
+
+        # compared with the class too, so that true doesn't match 1
+        self.enum = self.enum_values = None
+        if spec.get('enum') is not None:
+            self.enum_values = list(spec['enum'])
+            self.enum = frozenset((value.__class__, value) for value in self.enum_values)
+        self.min = spec.get('min')
+        self.max = spec.get('max')
+        self.bounded = self.enum is not None or self.min is not None or self.max is not None
+
+        self.keys = {key: Schema(value) for key, value in (spec.get('keys') or {}).items()}
+        self.required = list(spec.get('required') or ())
+        # None allows anything, False allows nothing
+        extra = spec.get('extra', True)
+        self.extra = None if extra is True else False if extra is False else Schema(extra)
+        self.items = Schema(spec['items']) if spec.get('items') is not None else None
+
+    def __repr__(self):
+        return "Schema({!r})".format(self.spec)
+
+    def build(self, buf, events, dict_type=dict, errors=None):
+        """Build objects from a stream of events like build(), checking each key and value as it goes
+
+        Raises a SchemaErr at the first key or value that doesn't match, before
+        the rest of the document is parsed. If errors is a list, each SchemaErr
+        is appended to it instead, and anything under a mismatched key, map
+        or list isn't checked. See parse_recover()."""
+        def fail(pos, reason):
+            err = SchemaErr(buf, pos, reason)
+            if errors is None:
+                raise err
+            errors.append(err)
+
+        stack = []  # (obj, schema, start) for each open map or list
+        top = key = None
+        is_list = False
+        schema, parent = self, None  # for the next value, and for top
+        for event, start, end, value in events:
+            if event == SCALAR:
+                # recover_events() puts a None with no text where a value couldn't be parsed
+                if schema is not None and (start != end or errors is None):
+                    if schema.types is not None and value.__class__ not in schema.types:
+                        fail(start, schema.mismatch(value.__class__, key, is_list, top))
+                    elif schema.bounded:
+                        reason = schema.check_value(value, key, is_list, top)
+                        if reason is not None:
+                            fail(start, reason)
+                if is_list:
+                    top.append(value)
+                elif top is not None:
+                    top[key] = value
+                else:
+                    yield value
+            elif event == KEY:
+                key = value
+                if parent is not None:
+                    schema = parent.keys.get(key)
+                    if schema is None:
+                        schema = parent.extra
+                        if schema is False:
+                            reason = "Unexpected key {!r}".format(key)
+                            if parent.keys:
+                                reason += ", expected one of: {}".format(", ".join(map(str, parent.keys)))
+                            fail(start, reason)
+                            schema = None
+            elif event == START_MAP or event == START_LIST:
+                cls = dict if event == START_MAP else list
+                if schema is not None and schema.types is not None and cls not in schema.types:
+                    fail(start, schema.mismatch(cls, key, is_list, top))
+                    schema = None
+                obj = dict_type() if event == START_MAP else []
+                if is_list:
+                    top.append(obj)
+                elif top is not None:
+                    top[key] = obj
+                stack.append((obj, schema, start))
+                top, is_list = obj, event == START_LIST
+                parent = schema
+                if is_list and schema is not None:
+                    schema = schema.items
+            else:
+                obj, parent, map_start = stack.pop()
+                if parent is not None and parent.required and not is_list:
+                    for required in parent.required:
+                        if required not in obj:
+                            fail(map_start, "Missing required key {!r}".format(required))
+                if stack:
+                    top, parent = stack[-1][0], stack[-1][1]
+                    is_list = top.__class__ is list
+                    schema = parent.items if is_list and parent is not None else None
+                else:
+                    top, is_list = None, False
+                    schema, parent = self, None
+                    yield obj
 
-        break
+    def check_value(self, value, key, is_list, top):
+        "Return why value is outside the enum or bounds, or None if it isn't"
+        cls = value.__class__
+        if self.enum is not None and (cls, value) not in self.enum:
+            return "Expected one of {} for {}, found {!r}".format(
+                ", ".join(map(repr, self.enum_values)), self.where(key, is_list, top), value)
+        if cls is int or cls is float:
+            if self.min is not None and value < self.min:
+                return "Expected at least {} for {}, found {!r}".format(self.min, self.where(key, is_list, top), value)
+            if self.max is not None and value > self.max:
+                return "Expected at most {} for {}, found {!r}".format(self.max, self.where(key, is_list, top), value)
+        return None
 
-    return out, pos
+    def entry(self):
+        """A copy for checking one top level entry of an indented document on its own
 
+        The document's type is checked with its first entry, and its
+        required keys can only be checked across all of its entries, which
+        ParseState.errors() does."""
+        entry = copy.copy(self)
+        entry.types, entry.required = None, []
+        return entry
 
-def parse_indented_map(buf, pos, output, options, my_indent, at_root):
-    out = OrderedDict()
+    def mismatch(self, cls, key, is_list, top):
+        return "Expected {} for {}, found {}".format(self.expected, self.where(key, is_list, top), SCHEMA_FOUND[cls])
 
-    while pos < len(buf):
-        m = key_name.match(buf, pos)
-        if not m:
-            break
+    def where(self, key, is_list, top):
+        if is_list:
+            return "a list item"
+        return "the document" if top is None else repr(key)
 
-        name, pos, is_bare = parse_key(buf, pos, output, options)
-        if name in out:
-            raise DuplicateKey(
-                buf, pos, "Can't have duplicate keys: {} is defined twice.".format(repr(name)))
 
-        if buf[pos] != ':':
-            if is_bare or not at_root:
-                raise BadKey(buf, pos, "Expected 'key:', but didn't find a ':', found {}".format(
-                    repr(buf[pos:])))
-            else:
-                raise NoRootObject(
-                    buf, pos, "Expected 'key:', but didn't find a ':', found a string {}. Note that strings must be inside a containing object or list, and cannot be root element".format(repr(buf[pos:])))
+class Node:
+    "A value in the document model, with the offsets of its source text"
+    __slots__ = ('start', 'end')
 
-        output.write(":")
-        pos += 1
-        if buf[pos] not in (' ', '\r', '\n'):
-            if options.fix_nospace:
-                output.write(' ')
-            else:
-                raise BadKey(buf, pos, "For key {}, expected space or newline after ':', found {}.".format(
-                    repr(name), repr(buf[pos:])))
 
-        new_pos, new_indent, next_line = move_to_next(buf, pos)
-        if next_line and new_indent < my_indent:
-            raise BadIndent(
-                buf, new_pos, "Missing value. Found a key, but the line afterwards isn't indented enough to count.")
+class ScalarNode(Node):
+    __slots__ = ('value',)
 
-        if not next_line:
-            output.write(buf[pos:new_pos])
-            obj, pos = parse_value(buf, new_pos, output, options)
-        else:
-            output.write(buf[pos:new_pos - new_indent])
-            obj, pos = parse_structure(
-                buf, new_pos - new_indent, output, options, indent=my_indent)
+    def __init__(self, value, start, end):
+        self.value = value
+        self.start = start
+        self.end = end
 
-        # dupe check
-        out[name] = obj
+    def __repr__(self):
+        return "ScalarNode({}, {}, {})".format(repr(self.value), self.start, self.end)
 
-        new_pos, new_indent, next_line = move_to_next(buf, pos)
-        if not next_line or new_indent != my_indent:
-            break
-        else:
-            output.write(buf[pos:new_pos])
-            pos = new_pos
+    def plain(self, dict_type=dict):
+        return self.value
 
-    return out, pos
 
+class ListNode(Node):
+    __slots__ = ('items',)
 
-def parse_value(buf, pos, output, options=None):
-    pos = skip_whitespace(buf, pos, output)
+    def __init__(self, items, start, end):
+        self.items = items
+        self.start = start
+        self.end = end
 
-    peek = buf[pos]
+    def __repr__(self):
+        return "ListNode({}, {}, {})".format(self.items, self.start, self.end)
 
-    if peek in ('*', '&', '?', '|', '<', '>', '%', '@'):
-        raise UnsupportedYAML(
-            buf, pos, "I found a {} outside of quotes. It's too special to let pass. Anchors, References, and other directives are not valid SafeYAML, Sorry.".format(peek))
-
-    if peek == '-' and buf[pos:pos + 3] == '---':
-        raise UnsupportedYAML(
-            buf, pos, "A SafeYAML document is a single document, '---' separators are unsupported")
-
-    if peek == '{':
-        return parse_map(buf, pos, output, options)
-    elif peek == '[':
-        return parse_list(buf, pos, output, options)
-    elif peek == "'" or peek == '"':
-        return parse_string(buf, pos, output, options)
-    elif peek in "-+0123456789":
-        return parse_number(buf, pos, output, options)
-    else:
-        return parse_bareword(buf, pos, output, options)
+    def __len__(self):
+        return len(self.items)
 
-    # raise ParserErr(buf, pos, "Bug in parser, sorry")
+    def __iter__(self):
+        return iter(self.items)
 
+    def __getitem__(self, index):
+        return self.items[index]
 
-def parse_map(buf, pos, output, options):
-    output.write('{')
-    out = OrderedDict()
+    def plain(self, dict_type=dict):
+        return [item.plain(dict_type) for item in self.items]
 
-    pos += 1
-    pos = skip_whitespace(buf, pos, output)
 
-    comma = None
+class MapNode(Node):
+    "A map as parallel lists of keys, key offsets, and value nodes, rather than a dict"
+    __slots__ = ('keys', 'key_starts', 'values')
 
-    while buf[pos] != '}':
+    def __init__(self, keys, key_starts, values, start, end):
+        self.keys = keys
+        self.key_starts = key_starts
+        self.values = values
+        self.start = start
+        self.end = end
 
-        key, new_pos, is_bare = parse_key(buf, pos, output, options)
+    def __repr__(self):
+        return "MapNode({}, {}, {}, {})".format(self.keys, self.values, self.start, self.end)
 
-        if key in out:
-            raise DuplicateKey(
-                buf, pos, 'duplicate key: {}, {}'.format(key, out))
+    def __len__(self):
+        return len(self.keys)
 
-        pos = skip_whitespace(buf, new_pos, output)
+    def __iter__(self):
+        return iter(self.keys)
 
-        peek = buf[pos]
+    def __getitem__(self, key):
+        try:
+            return self.values[self.keys.index(key)]
+        except ValueError:
+            raise KeyError(key)
 
-        # bare key check
+    def items(self):
+        return zip(self.keys, self.values)
 
-        if peek == ':':
-            output.write(':')
-            pos += 1
-        else:
-            raise BadKey(
-                buf, pos, "Expected a ':', when parsing a key: value pair but found {}".format(repr(peek)))
+    def plain(self, dict_type=dict):
+        return dict_type((key, value.plain(dict_type)) for key, value in zip(self.keys, self.values))
 
-        if is_bare and buf[pos] not in (' ', '\r', '\n'):
-            if options.fix_nospace:
-                output.write(' ')
-            else:
-                raise BadKey(buf, pos, "For key {}, expected space or newline after ':', found {}.".format(
-                    repr(key), repr(buf[pos:])))
 
-        pos = skip_whitespace(buf, pos, output)
+def parse_nodes(buf, options=None):
+    "Parse every document in buf into a tree of Nodes, returning the root node of each"
+    return list(build_nodes(document_events(buf, None, options or Options())))
 
-        item, pos = parse_value(buf, pos, output, options)
 
-        # dupe check
-        out[key] = item
+def build_nodes(events):
+    "Build Nodes from a stream of events, yielding each root node as it ends"
+    stack = []
+    top = None
+    for event, start, end, value in events:
+        if event == KEY:
+            top.keys.append(value)
+            top.key_starts.append(start)
+            continue
+        elif event == END_MAP or event == END_LIST:
+            node = stack.pop()
+            node.end = end
+            if stack:
+                top = stack[-1]
+            else:
+                top = None
+                yield node
+            continue
+        elif event == SCALAR:
+            node = ScalarNode(value, start, end)
+        elif event == START_MAP:
+            node = MapNode([], [], [], start, None)
+        else:
+            node = ListNode([], start, None)
 
-        pos = skip_whitespace(buf, pos, output)
+        if top is None:
+            if event == SCALAR:
+                yield node
+        elif top.__class__ is MapNode:
+            top.values.append(node)
+        else:
+            top.items.append(node)
 
-        peek = buf[pos]
-        comma = False
-        if peek == ',':
-            pos += 1
-            output.write(',')
-            comma = True
-            pos = skip_whitespace(buf, pos, output)
-        elif peek != '}':
-            raise SyntaxErr(
-                buf, pos, "Expecting a ',', or a '{}' but found {}".format('}', repr(peek)))
+        if event != SCALAR:
+            stack.append(node)
+            top = node
 
-    if options.force_commas:
-        if out and comma == False:
-            output.write(',')
-    output.write('}')
-    return out, pos + 1
 
+def parse_key(buf, pos, edits, options, m=None):
+    if m is None:
+        m = key_name.match(buf, pos)
+        if m is None:
+            name, pos = parse_string(buf, pos, edits, options)
+            return sys.intern(name), pos, False
 
-def parse_key(buf, pos, output, options):
-    m = identifier.match(buf, pos)
-    if m:
+    if m.lastgroup == 'ident':
+        if options.max_string_length is not None and m.end() - pos > options.max_string_length:
+            raise StringTooLong(buf, pos, "Key too long: found more than {} characters".format(options.max_string_length))
         item = buf[pos:m.end()]
         name = item.lower()
 
@@ -493,50 +1405,16 @@ def parse_key(buf, pos, output, options):
         elif options.force_string_keys:
             item = '"{}"'.format(item)
 
-        output.write(item)
+        if edits is not None and item != buf[pos:m.end()]:
+            edits.append((pos, m.end() - pos, item))
         pos = m.end()
-        return name, pos, True
+        return sys.intern(name), pos, True
     else:
-        name, pos = parse_string(buf, pos, output, options)
-        return name, pos, False
-
-
-def parse_list(buf, pos, output, options):
-    output.write("[")
-    out = []
-
-    pos += 1
-
-    pos = skip_whitespace(buf, pos, output)
-    comma = None
-
-    while buf[pos] != ']':
-        item, pos = parse_value(buf, pos, output, options)
-        out.append(item)
-
-        pos = skip_whitespace(buf, pos, output)
-
-        peek = buf[pos]
-        comma = False
-        if peek == ',':
-            output.write(',')
-            comma = True
-            pos += 1
-            pos = skip_whitespace(buf, pos, output)
-        elif peek != ']':
-            raise SyntaxErr(
-                buf, pos, "Inside a [], Expecting a ',', or a ']' but found {}".format(repr(peek)))
-    if options.force_commas:
-        if out and comma == False:
-            output.write(',')
-    output.write("]")
-    pos += 1
-
-    return out, pos
+        end = m.end()
+        return sys.intern(string_value(buf, pos, end, options)), end, False
 
 
-def parse_string(buf, pos, output, options):
-    s = io.StringIO()
+def parse_string(buf, pos, edits, options, decode=True):
     peek = buf[pos]
 
     # validate string
@@ -544,60 +1422,50 @@ def parse_string(buf, pos, output, options):
         m = string_sq.match(buf, pos)
         if m:
             end = m.end()
-            output.write(buf[pos:end])
         else:
             raise BadString(buf, pos, "Invalid single quoted string")
     else:
         m = string_dq.match(buf, pos)
         if m:
             end = m.end()
-            output.write(buf[pos:end])
         else:
             raise BadString(buf, pos, "Invalid double quoted string")
 
-    lo = pos + 1  # skip quotes
-    while lo < end - 1:
-        hi = buf.find("\\", lo, end)
-        if hi == -1:
-            s.write(buf[lo:end - 1])  # skip quote
-            break
+    return string_value(buf, pos, end, options, decode), end
 
-        s.write(buf[lo:hi])
-
-        esc = buf[hi + 1]
-        if esc in str_escapes:
-            s.write(str_escapes[esc])
-            lo = hi + 2
-        elif esc == 'x':
-            n = int(buf[hi + 2:hi + 4], 16)
-            s.write(chr(n))
-            lo = hi + 4
-        elif esc == 'u':
-            n = int(buf[hi + 2:hi + 6], 16)
-            if 0xD800 <= n <= 0xDFFF:
-                raise BadString(
-                    buf, hi, 'string cannot have surrogate pairs')
-            s.write(chr(n))
-            lo = hi + 6
-        elif esc == 'U':
-            n = int(buf[hi + 2:hi + 10], 16)
-            if 0xD800 <= n <= 0xDFFF:
-                raise BadString(
-                    buf, hi, 'string cannot have surrogate pairs')
-            s.write(chr(n))
-            lo = hi + 10
-        else:
-            raise UnsupportedEscape(
-                buf, hi, "Unkown escape character {}".format(repr(esc)))
 
-    out = s.getvalue()
+def string_value(buf, pos, end, options, decode=True):
+    "Decode the quoted string between pos and end. With decode=False, only strings with escapes are decoded, to check them"
+    if options.max_string_length is not None and end - pos - 2 > options.max_string_length:
+        raise StringTooLong(buf, pos, "String too long: found more than {} characters".format(options.max_string_length))
+    if buf.find("\\", pos + 1, end) == -1:
+        return buf[pos + 1:end - 1] if decode else None
+    return unescape_string(buf, pos + 1, end - 1)
 
-    # XXX output.write string.escape
 
-    return out, end
+def unescape(m):
+    esc = m.group(4)
+    if esc is None:
+        n = int(m.group(m.lastindex), 16)
+        if 0xD800 <= n <= 0xDFFF:
+            raise BadString(
+                m.string, m.start(), 'string cannot have surrogate pairs')
+        return chr(n)
+    elif esc in str_escapes:
+        return str_escapes[esc]
+    else:
+        raise UnsupportedEscape(
+            m.string, m.start(), "Unkown escape character {}".format(repr(esc)))
+
+
+def unescape_string(buf, lo, hi):
+    try:
+        return escape_seq.sub(unescape, buf[lo:hi])
+    except ParserErr as p:
+        raise p.__class__(buf, lo + p.pos, p.reason)
 
 
-def parse_number(buf, pos, output, options):
+def parse_number(buf, pos, edits, options):
     flt_end = None
     exp_end = None
 
@@ -636,12 +1504,10 @@ def parse_number(buf, pos, output, options):
             raise BadNumber(
                 buf, pos, "Can't have leading zeros on non-zero integers")
 
-    output.write(buf[start:end])
-
     return out, end
 
 
-def parse_bareword(buf, pos, output, options):
+def parse_bareword(buf, pos, edits, options):
     m = identifier.match(buf, pos)
     item = None
     if m:
@@ -651,7 +1517,8 @@ def parse_bareword(buf, pos, output, options):
 
         if name in builtin_names:
             out = builtin_names[name]
-            output.write(name)
+            if edits is not None and item != name:
+                edits.append((pos, end - pos, name))
             return out, m.end()
         elif options.fix_unquoted:
             pass
@@ -667,24 +1534,919 @@ def parse_bareword(buf, pos, output, options):
         if m:
             end = m.end()
             item = buf[pos:end].strip()
-            output.write('"{}"'.format(item))
             if buf[end:end + 1] not in ('', '\r', '\n', '#'):
                 raise Bareword(
                     buf, pos, "The parser is trying its very best but could only make out '{}', but there is other junk on that line. You fix it.".format(item))
-            elif buf[end:end + 1] == '#':
-                output.write(' ')
+            if edits is not None:
+                quoted = '"{}"'.format(item)
+                if buf[end:end + 1] == '#':
+                    quoted += ' '
+                edits.append((pos, end - pos, quoted))
 
             return item, m.end()
     raise Bareword(buf, pos, "The parser doesn't know how to parse anymore and has given up. Use less barewords: {}...".format(
         repr(buf[pos:pos + 5])))
 
 
+def dumps(obj, flow=False, indent=2):
+    "Serialize a dict or list as a SafeYAML document, in indented blocks, or in flow style, like JSON"
+    out = []
+    dump_root(obj, out, None, flow, indent)
+    return "".join(out)
+
+
+def dump(obj, fh, flow=False, indent=2):
+    "Write a dict or list to fh as a SafeYAML document, a chunk at a time"
+    out = []
+    dump_root(obj, out, fh, flow, indent)
+    fh.write("".join(out))
+
+
+def dump_root(obj, out, fh, flow, indent):
+    if not isinstance(obj, (dict, list, tuple)):
+        raise TypeError("A SafeYAML document must be a dict or a list, not {}".format(type(obj).__name__))
+    # a list item needs a '-' and a space before its value
+    if indent < 2:
+        raise ValueError("Can't indent by less than 2, not {}".format(indent))
+    if flow or not obj:
+        dump_flow(obj, out, fh)
+        out.append("\n")
+    else:
+        dump_block(obj, out, fh, 0, indent)
+
+
+def dump_block(obj, out, fh, level, indent, first_prefix=None):
+    prefix = " " * level
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            out.append(prefix if first_prefix is None else first_prefix)
+            first_prefix = None
+            out.append(dump_key(key))
+            if value and isinstance(value, (dict, list, tuple)):
+                out.append(":\n")
+                dump_block(value, out, fh, level + indent, indent)
+            else:
+                out.append(": ")
+                dump_flow(value, out, fh)
+                out.append("\n")
+            if fh is not None and len(out) > 4096:
+                fh.write("".join(out))
+                del out[:]
+    else:
+        for item in obj:
+            if not item or not isinstance(item, (dict, list, tuple)):
+                out.append(prefix)
+                out.append("- ")
+                if isinstance(item, str):
+                    # a ': ' anywhere on a '- ' line is read as the start of a map
+                    out.append(quote_string(item).replace(": ", "\\x3a "))
+                else:
+                    dump_flow(item, out, fh)
+                out.append("\n")
+            elif isinstance(item, dict):
+                # '- key: value' can only start a map if the value is on the same line
+                first = next(iter(item.values()))
+                if first and isinstance(first, (dict, list, tuple)):
+                    out.append(prefix)
+                    out.append("-\n")
+                    dump_block(item, out, fh, level + indent, indent)
+                else:
+                    dump_block(item, out, fh, level + indent, indent, prefix + "-" + " " * (indent - 1))
+            else:
+                out.append(prefix)
+                out.append("-\n")
+                dump_block(item, out, fh, level + indent, indent)
+            if fh is not None and len(out) > 4096:
+                fh.write("".join(out))
+                del out[:]
+
+
+def dump_flow(obj, out, fh):
+    if isinstance(obj, dict):
+        out.append("{")
+        for i, (key, value) in enumerate(obj.items()):
+            if i:
+                out.append(", ")
+            out.append(dump_key(key))
+            out.append(": ")
+            dump_flow(value, out, fh)
+        out.append("}")
+    elif isinstance(obj, (list, tuple)):
+        out.append("[")
+        for i, item in enumerate(obj):
+            if i:
+                out.append(", ")
+            dump_flow(item, out, fh)
+        out.append("]")
+    else:
+        out.append(dump_scalar(obj))
+    if fh is not None and len(out) > 4096:
+        fh.write("".join(out))
+        del out[:]
+
+
+def dump_scalar(obj):
+    if isinstance(obj, str):
+        return quote_string(obj)
+    elif obj is None:
+        return "null"
+    elif obj is True:
+        return "true"
+    elif obj is False:
+        return "false"
+    elif isinstance(obj, int):
+        return int.__repr__(obj)
+    elif isinstance(obj, float):
+        if obj != obj or obj in (float('inf'), float('-inf')):
+            raise ValueError("Can't write {} in SafeYAML".format(repr(obj)))
+        out = float.__repr__(obj)
+        if 'e' in out and '.' not in out:
+            # YAML 1.1 reads 1e+16 as a string
+            out = out.replace('e', '.0e')
+        return out
+    raise TypeError("Can't write a {} in SafeYAML".format(type(obj).__name__))
+
+
+def dump_key(key):
+    if not isinstance(key, str):
+        raise TypeError("Keys must be strings in SafeYAML, not {}".format(type(key).__name__))
+    # barewords are read back lowercased, and can't be a builtin or reserved name, or a float in YAML
+    if identifier.fullmatch(key) and key == key.lower() and key not in builtin_names and key not in reserved_names \
+            and not yaml_float_key.match(key):
+        return key
+    return quote_string(key)
+
+
+def quote_string(s):
+    out = encode_basestring(s)
+    if yaml_escapes.search(out) is None:
+        return out
+    if surrogates.search(out):
+        raise ValueError("Can't write a string with surrogates in SafeYAML: {}".format(repr(s)))
+    return yaml_escapes.sub(lambda m: "\\u{:04x}".format(ord(m.group())), out)
+
+
+def write_json(source, fh, options=None):
+    """Transcode every document in a string or file object to fh as a JSON list, straight from the parser's events
+
+    No objects are built: strings are escaped as they are parsed, and numbers
+    are copied from the source, so memory use doesn't grow with the document.
+    On an error, the JSON written so far is left incomplete. The schema option
+    isn't checked here, only by parse() and iter_parse()."""
+    options = options or Options()
+    out = ["["]
+    append = out.append
+    # a ', ' goes before anything that follows a value
+    comma = False
+    for buf, line_offset, events in read_documents(source, options):
+        try:
+            for event, start, end, value in events:
+                if event == SCALAR:
+                    if value.__class__ is str:
+                        value = encode_basestring_ascii(value)
+                    else:
+                        value = json_scalar(buf, start, end, value)
+                    append(", " + value if comma else value)
+                    comma = True
+                elif event == KEY:
+                    value = encode_basestring_ascii(value)
+                    append(", " + value + ": " if comma else value + ": ")
+                    comma = False
+                elif event == START_MAP:
+                    append(", {" if comma else "{")
+                    comma = False
+                elif event == START_LIST:
+                    append(", [" if comma else "[")
+                    comma = False
+                else:
+                    append("}" if event == END_MAP else "]")
+                    comma = True
+                if len(out) > 4096:
+                    fh.write("".join(out))
+                    del out[:]
+        except ParserErr as p:
+            fh.write("".join(out))
+            p.line_offset = line_offset
+            raise
+    append("]")
+    fh.write("".join(out))
+
+
+def json_scalar(buf, start, end, value):
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    elif value is None:
+        return "null"
+    elif value is True:
+        return "true"
+    elif value is False:
+        return "false"
+    m = json_number.fullmatch(buf, start + (buf[start] == '+'), end)
+    if m:
+        return m.group()
+    # leading zeros, or a float that json writes differently
+    return json.dumps(value)
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'safeyaml')
+
+
+PARSER_VERSION = None
+
+
+def parser_version():
+    "A hash of the parser's own source, so any change to it misses every cache"
+    global PARSER_VERSION
+    if PARSER_VERSION is None:
+        with open(__file__, 'rb') as fh:
+            PARSER_VERSION = hashlib.sha256(fh.read()).hexdigest()
+    return PARSER_VERSION
+
+
+# the files a ResultCache or load_cached() writes: <2 hex>/<64 hex>.json or .marshal, and leftover temporary files
+cache_prefix = re.compile(r"[0-9a-f]{2}$")
+cache_entry = re.compile(r"[0-9a-f]{64}\.(?:json|marshal)(?:\.[0-9]+\.tmp)?$")
+
+
+def list_dir(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+class ResultCache:
+    "An on-disk cache of parse results, keyed by the document, the options, and the parser's own source"
+
+    def __init__(self, path=None, max_size=64 * 1024 * 1024, max_age=30 * 24 * 60 * 60):
+        self.path = path or default_cache_dir()
+        self.max_size = max_size
+        self.max_age = max_age
+        self.version = None
+
+    def key(self, buf, options):
+        if self.version is None:
+            self.version = parser_version()
+
+        h = hashlib.sha256(self.version.encode())
+        h.update(repr(sorted(vars(options).items())).encode())
+        h.update(buf.encode('utf-8', 'surrogatepass'))
+        return h.hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def get(self, key):
+        filename = self.filename(key)
+        try:
+            with open(filename) as fh:
+                entry = json.load(fh)
+            os.utime(filename)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key, entry):
+        filename = self.filename(key)
+        tmp = "{}.{}.tmp".format(filename, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(tmp, 'w') as fh:
+                json.dump(entry, fh)
+            os.replace(tmp, filename)
+        except OSError:
+            pass
+
+    def check(self, buf, options=None, output=None):
+        "Check buf like parse(), raising ParserErr and writing fixed text to output, but only parse on a cache miss"
+        options = options or Options()
+        key = self.key(buf, options)
+
+        entry = self.get(key)
+        if entry is None or (output is not None and entry['ok'] and 'output' not in entry):
+            fixed = io.StringIO() if output is not None else None
+            try:
+                parse(buf, output=fixed, options=options)
+            except ParserErr as p:
+                self.put(key, {'ok': False, 'error': p.name(), 'pos': p.pos, 'reason': p.reason})
+                raise
+
+            entry = {'ok': True}
+            if fixed is not None:
+                entry['output'] = fixed.getvalue()
+            self.put(key, entry)
+
+        if not entry['ok']:
+            error = globals().get(entry['error'])
+            if not (isinstance(error, type) and issubclass(error, ParserErr)):
+                error = ParserErr
+            raise error(buf, entry['pos'], entry['reason'])
+
+        if output is not None:
+            output.write(entry['output'])
+
+    def evict(self):
+        """Remove entries older than max_age, then the least recently used until the cache fits in max_size
+
+        Only the files the cache writes are considered, so anything else in
+        the directory is left alone."""
+        now = time.time()
+        entries = []
+        for prefix in list_dir(self.path):
+            if not cache_prefix.match(prefix):
+                continue
+            for name in list_dir(os.path.join(self.path, prefix)):
+                if not (cache_entry.match(name) and name.startswith(prefix)):
+                    continue
+                filename = os.path.join(self.path, prefix, name)
+                try:
+                    st = os.stat(filename)
+                    if self.max_age is not None and now - st.st_mtime > self.max_age:
+                        os.remove(filename)
+                    else:
+                        entries.append((st.st_mtime, st.st_size, filename))
+                except OSError:
+                    pass
+
+        if self.max_size is None:
+            return
+
+        total = sum(size for mtime, size, filename in entries)
+        for mtime, size, filename in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+
+
+def load_cached(path, options=None, cache_dir=None):
+    """Parse a file like parse(), keeping a snapshot of the documents to load instead next time
+
+    Snapshots are written with marshal, alongside the ResultCache entries
+    in cache_dir, and are keyed by the file's contents, the options, the
+    parser's source, and the Python version, so a changed file is parsed
+    again. Errors aren't cached. Maps built with a dict_type other than
+    dict can't be marshalled, so they are parsed every time."""
+    options = options or Options()
+    with open(path, 'rb') as fh:
+        data = fh.read()
+
+    h = hashlib.sha256(parser_version().encode())
+    h.update(repr((sys.implementation.cache_tag, marshal.version, sorted(vars(options).items()))).encode())
+    h.update(data)
+    key = h.hexdigest()
+    filename = os.path.join(cache_dir or default_cache_dir(), key[:2], key + '.marshal')
+
+    try:
+        with open(filename, 'rb') as fh:
+            docs = marshal.loads(fh.read())
+        os.utime(filename)
+        return docs
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    docs = parse(data, options=options)
+    tmp = "{}.{}.tmp".format(filename, os.getpid())
+    try:
+        snapshot = marshal.dumps(docs)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(tmp, 'wb') as fh:
+            fh.write(snapshot)
+        os.replace(tmp, filename)
+    except (OSError, ValueError):
+        pass
+    return docs
+
+
+class ConfigCache:
+    """An in-process cache of parsed files, which only parses a file again once os.stat() shows it has changed
+
+    Every load() of an unchanged file returns the same objects, so they
+    shouldn't be modified. The least recently used files are dropped past
+    max_entries. If on_change is given, it is called as on_change(path, docs)
+    whenever a file is parsed again because it changed."""
+
+    def __init__(self, options=None, max_entries=128, on_change=None):
+        self.options = options or Options()
+        self.max_entries = max_entries
+        self.on_change = on_change
+        self.entries = OrderedDict()  # path -> (stat key, docs, (error class, buf, pos, reason)), least recently used first
+        self.lock = threading.Lock()
+
+    def stat_key(self, st):
+        return (st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino, st.st_dev)
+
+    def load(self, path):
+        "Return the documents in path as parse() would, raising ParserErr if it doesn't parse"
+        key = self.stat_key(os.stat(path))
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == key:
+                self.entries.move_to_end(path)
+                if entry[2] is not None:
+                    # a new error each time, as raising one adds to its traceback
+                    cls, buf, pos, reason = entry[2]
+                    raise cls(buf, pos, reason)
+                return entry[1]
+
+        # parse outside the lock, so one slow file doesn't hold up the others
+        with open(path, newline='') as fh:
+            key = self.stat_key(os.fstat(fh.fileno()))
+            buf = fh.read()
+        docs, error, cached = None, None, None
+        try:
+            docs = parse(buf, options=self.options)
+        except ParserErr as p:
+            error, cached = p, (p.__class__, p.buf, p.pos, p.reason)
+
+        with self.lock:
+            self.entries[path] = (key, docs, cached)
+            self.entries.move_to_end(path)
+            while self.max_entries is not None and len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        if entry is not None and self.on_change is not None:
+            self.on_change(path, docs)
+        if error is not None:
+            raise error
+        return docs
+
+    def refresh(self):
+        "Check every cached file, parsing the changed ones again, and dropping any that have gone"
+        with self.lock:
+            paths = list(self.entries)
+        for path in paths:
+            try:
+                self.load(path)
+            except ParserErr:
+                pass
+            except OSError:
+                with self.lock:
+                    self.entries.pop(path, None)
+
+
+def find_files(paths, extensions=('.yaml', '.yml'), missing=None):
+    """Expand directories and glob patterns into a list of filenames
+
+    A path that exists is taken as it is, even if it looks like a pattern.
+    If missing is a list, each path that doesn't exist and matches nothing is
+    appended to it, instead of being passed on."""
+    out = []
+    for path in paths:
+        if os.path.exists(path):
+            names = [path]
+        elif any(c in path for c in '*?['):
+            names = sorted(glob.glob(path, recursive=True))
+        else:
+            names = []
+        if not names:
+            if missing is None:
+                names = [path]
+            else:
+                missing.append(path)
+
+        for name in names:
+            if os.path.isdir(name):
+                for root, dirs, files in os.walk(name):
+                    dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                    out.extend(os.path.join(root, f)
+                               for f in sorted(files) if f.endswith(extensions))
+            else:
+                out.append(name)
+    return out
+
+
+def first_difference(a, b):
+    "The offset of the first character that differs between a and b"
+    n = min(len(a), len(b))
+    pos = 0
+    while pos < n and a[pos:pos + 4096] == b[pos:pos + 4096]:
+        pos += 4096
+    while pos < n and a[pos] == b[pos]:
+        pos += 1
+    return min(pos, n)
+
+
+def write_file(filename, text):
+    "Replace the contents of a file by writing a temporary file alongside it and renaming it over the original"
+    # write through a symlink, rather than replacing the link itself
+    filename = os.path.realpath(filename)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename) or '.',
+                               prefix='.{}.'.format(os.path.basename(filename)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', newline='') as fh:
+            fh.write(text)
+        os.chmod(tmp, stat.S_IMODE(os.stat(filename).st_mode))
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def lint_file(filename, options, in_place=False, cache=None, check=False, all_errors=False):
+    """Check a file, returning a 'filename:line:col:reason' diagnostic or None
+
+    With in_place, write the fixed output back if it differs, and with check,
+    report where the file would change instead. With all_errors, every error
+    is reported, one per line."""
+    try:
+        with open(filename, newline='') as fh:
+            if cache is None and not (in_place or check):
+                for obj in iter_parse(fh, options):
+                    pass
+                return None
+            buf = fh.read()
+
+        output = io.StringIO() if in_place or check else None
+        if cache is not None:
+            cache.check(buf, options=options, output=output)
+        else:
+            parse(buf, output=output, options=options)
+
+        if output is not None:
+            output = output.getvalue()
+            if output != buf:
+                if check:
+                    line, col = get_position(buf, first_difference(buf, output))
+                    return "{}:{}:{}:{}".format(filename, line, col, "File would be changed by --in-place")
+                write_file(filename, output)
+    except ParserErr as p:
+        errors, index = [p], None
+        if all_errors:
+            with open(filename, newline='') as fh:
+                buf = fh.read()
+            recovered = parse_recover(buf, options)[1]
+            if recovered:
+                errors, index = recovered, LineIndex(buf)
+        diagnostics = []
+        for p in errors:
+            line, col = p.position(index)
+            diagnostics.append("{}:{}:{}:{}".format(filename, line, col, p.explain()))
+        return "\n".join(diagnostics)
+    except (OSError, UnicodeDecodeError) as e:
+        return "{}:1:1:{}".format(filename, e)
+    return None
+
+
+def lint_files(filenames, options, jobs=1, in_place=False, cache=None, check=False, all_errors=False):
+    "Run lint_file over many files, in a pool of processes unless jobs is 1 (0 for one per CPU), yielding (filename, diagnostic)"
+    if jobs == 1 or len(filenames) < 2:
+        for filename in filenames:
+            yield filename, lint_file(filename, options, in_place, cache, check, all_errors)
+        return
+
+    workers = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(filenames) // (workers * 8))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lint_file, filenames, itertools.repeat(options), itertools.repeat(in_place),
+                           itertools.repeat(cache), itertools.repeat(check), itertools.repeat(all_errors),
+                           chunksize=chunksize)
+        yield from zip(filenames, results)
+
+
+class Block:
+    """A run of a ParseState's buffer, from a point where the parser can start again, up to the next
+
+    A block starts a document, with a state of None, or an entry in the root
+    indented map or list of a document, with a state of (kind, indent). From
+    there, the parser carries on just as it would in a full parse, so each
+    block has the errors parse_recover() finds in it, if none of its keys
+    came before it. When one did, errors() parses it again with those keys,
+    and checks the required keys of the document too."""
+    __slots__ = ('start', 'state', 'errors', 'trailing', 'keys', 'names', 'root')
+
+    def __init__(self, start, state):
+        self.start = start
+        self.state = state
+        # errors as (class, offset from start, reason), with those after the document ends in trailing
+        self.errors, self.trailing = [], []
+        self.keys = []  # the keys of the root map in the block
+        self.names = set()  # every key the root map saw, even those that went wrong
+        self.root = None  # the offset of the document's root indented map
+
+    def parse(self, buf, options, entry_options, keys=()):
+        """Parse the block, returning the (start, state) of the next block, or (None, None) at the end of buf
+
+        The root map starts with keys, the keys before the block."""
+        start = pos = self.start
+        stack, head, errors, found, frames = [], [], [], [], []
+        if self.state is None:
+            if pos == len(buf):
+                return None, None
+            if pos == 0 and buf.startswith("\uFEFF"):
+                pos = 1
+        else:
+            kind, indent = self.state
+            if kind == INDENTED_MAP:
+                stack.append([INDENTED_MAP, set(keys), indent, True, None])
+            else:
+                stack.append([INDENTED_LIST, 0, indent])
+            options = entry_options.get(kind, options)
+            head.append((START_MAP if kind == INDENTED_MAP else START_LIST, start, start, None))
+            pos -= 1  # carry on from the end of the line before, as if a value had just ended
+        events = recover_events(buf, pos, None, options, errors, stack)
+
+        def entries():
+            "Pass on the events up to the next entry of the root map or list"
+            seen = False
+            while True:
+                try:
+                    event = next(events)
+                except StopIteration as done:
+                    found.append((done.value, None))
+                    return
+                if stack and not frames:
+                    frames.append(stack[0])
+                kind = stack[0][0] if len(stack) == 1 else None
+                if kind == INDENTED_MAP and event[0] == KEY or \
+                        kind == INDENTED_LIST and event[0] in (SCALAR, START_MAP, START_LIST):
+                    if seen:
+                        indent = stack[0][2]
+                        line = buf.rfind('\n', 0, event[1]) + 1
+                        # a list item's value can be on a line after its '-'
+                        while kind == INDENTED_LIST and buf[line:line + indent + 1] != ' ' * indent + '-':
+                            line = buf.rfind('\n', 0, line - 1) + 1
+                        found.append((line, (kind, indent)))
+                        if kind == INDENTED_MAP:
+                            # the next entry's key, which was added before it was passed on
+                            frames[0][1].discard(event[3])
+                        return
+                    seen = True
+                    if event[0] == KEY:
+                        self.keys.append(event[3])
+                elif not stack and event[0] == START_MAP and event[1] == event[2]:
+                    self.root = event[1] - start
+                yield event
+
+        if options.schema is not None:
+            for obj in options.schema.build(buf, itertools.chain(head, entries()), options.dict_type, errors):
+                pass
+        else:
+            for event in entries():
+                pass
+
+        pos, state = found[0]
+        count = len(errors)
+        if state is not None:
+            next_block = pos, state
+        else:
+            # the document ended, as in document_events()
+            pos = skip_whitespace(buf, pos)
+            if buf[pos:pos+3] == '---':
+                pos += 3
+            elif pos < len(buf):
+                errors.append(TrailingContent(buf, pos, "Trailing content: {}".format(repr(buf[pos:pos + 10]))))
+                m = document_start.search(buf, pos)
+                pos = m.start() if m else len(buf)
+            next_block = (pos, None) if pos < len(buf) else (None, None)
+
+        if frames and frames[0][0] == INDENTED_MAP:
+            self.names = frames[0][1].difference(keys)
+        self.errors = [(err.__class__, err.pos - start, err.reason) for err in errors[:count]]
+        self.trailing = [(err.__class__, err.pos - start, err.reason) for err in errors[count:]]
+        return next_block
+
+
+class ParseState:
+    """The errors in a buffer that is edited a little at a time, as in an editor
+
+    The buffer is split into blocks at the start of each document, and of
+    each entry in a document's root indented map or list, where the parser
+    can start again, so an edit only re-parses the blocks it touches. The
+    errors are the same as parse_recover() finds, other than what it finds
+    inside the value of a duplicate key, which is skipped here."""
+
+    def __init__(self, text, options=None):
+        self.options = options or Options()
+        self.text = text
+
+        # the options for each entry of an indented map or list, see Schema.entry()
+        self.entry_options = {}
+        schema = self.options.schema
+        if schema is not None:
+            for kind, cls in ((INDENTED_MAP, dict), (INDENTED_LIST, list)):
+                options = copy.copy(self.options)
+                options.schema = schema.entry() if schema.types is None or cls in schema.types else None
+                self.entry_options[kind] = options
+
+        self.blocks = []
+        pos, state = 0, None
+        while pos is not None:
+            block = Block(pos, state)
+            self.blocks.append(block)
+            pos, state = block.parse(text, self.options, self.entry_options)
+
+    def edit(self, start, end, text):
+        "Replace self.text[start:end] with text, re-parsing the blocks it changes"
+        self.text = self.text[:start] + text + self.text[end:]
+        delta = len(text) - (end - start)
+        blocks = self.blocks
+        starts = [block.start for block in blocks]
+
+        # the parser reads ahead to the first line of a block with content to find
+        # where it starts, so an edit can change the two blocks before it
+        first = max(bisect.bisect_right(starts, start) - 3, 0)
+        # the blocks after the edit can be kept, once a new block starts where one of them did, in the same state
+        keep = bisect.bisect_left(starts, end)
+        new_blocks = []
+        pos, state = blocks[first].start, blocks[first].state
+        while pos is not None:
+            block = Block(pos, state)
+            new_blocks.append(block)
+            pos, state = block.parse(self.text, self.options, self.entry_options)
+            while keep < len(blocks) and pos is not None and blocks[keep].start + delta < pos:
+                keep += 1
+            if keep < len(blocks) and blocks[keep].start + delta == pos and blocks[keep].state == state:
+                break
+        else:
+            keep = len(blocks)
+
+        tail = blocks[keep:]
+        for block in tail:
+            block.start += delta
+        self.blocks = blocks[:first] + new_blocks + tail
+
+    def errors(self):
+        "Return every error in the buffer, in order"
+        text, options = self.text, self.options
+        if not text:
+            return [NoRootObject(text, 0, "Empty Document")]
+        if options.max_size is not None and len(text) > options.max_size:
+            return [TooLarge(text, options.max_size, "Document too large: found more than {} characters".format(options.max_size))]
+
+        schema = options.schema
+        out = []
+        documents = []  # the first block, keys, and number of blocks of each document
+        blocks, names, i = self.blocks, set(), 0
+        while i < len(blocks):
+            parsed = [blocks[i]]
+            i += 1
+            if parsed[0].state is not None and not parsed[0].names.isdisjoint(names):
+                # the root map already saw one of the keys, so parse again with the keys
+                # before it, until a block starts where one did before, in the same state
+                pos, state, seen = parsed[0].start, parsed[0].state, set(names)
+                parsed = []
+                while True:
+                    block = Block(pos, state)
+                    pos, state = block.parse(text, options, self.entry_options, seen)
+                    parsed.append(block)
+                    seen = set() if state is None else seen | block.names
+                    if pos is None:
+                        i = len(blocks)
+                        break
+                    while i < len(blocks) and blocks[i].start < pos:
+                        i += 1
+                    if i < len(blocks) and blocks[i].start == pos and blocks[i].state == state:
+                        break
+
+            for block in parsed:
+                if block.state is None:
+                    documents.append([block, [], 0])
+                    names = set()
+                for cls, pos, reason in block.errors + block.trailing:
+                    out.append(cls(text, block.start + pos, reason))
+                documents[-1][1].extend(block.keys)
+                documents[-1][2] += 1
+                names.update(block.names)
+
+        # the schema checks a document with only one block itself
+        if schema is not None and (schema.types is None or dict in schema.types):
+            for first, keys, count in documents:
+                if count > 1 and first.root is not None:
+                    for required in schema.required:
+                        if required not in keys:
+                            out.append(SchemaErr(text, first.start + first.root, "Missing required key {!r}".format(required)))
+
+        out.sort(key=lambda err: err.pos)
+        return out
+
+
+def read_message(fh):
+    "Read a language server message from a binary file, or None at the end"
+    length = None
+    while True:
+        line = fh.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            break
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    if length is None:
+        return None
+    return json.loads(fh.read(length).decode('utf-8'))
+
+
+def write_message(fh, message):
+    body = json.dumps(message).encode('utf-8')
+    fh.write("Content-Length: {}\r\n\r\n".format(len(body)).encode('ascii') + body)
+    fh.flush()
+
+
+def utf16_index(line, character):
+    "Convert an offset in UTF-16 code units, as the language server protocol counts them, to an index into line"
+    if line.isascii():
+        return min(character, len(line))
+    units = 0
+    for i, c in enumerate(line):
+        if units >= character:
+            return i
+        units += 2 if ord(c) > 0xFFFF else 1
+    return len(line)
+
+
+def lsp_offset(text, index, position):
+    "Convert a language server {line, character} position to an offset in text"
+    if position['line'] >= len(index.starts):
+        return len(text)
+    start = index.starts[position['line']]
+    end = text.find('\n', start)
+    line = text[start:len(text) if end < 0 else end]
+    return start + utf16_index(line, position['character'])
+
+
+def lsp_diagnostics(state):
+    "Convert the errors in a ParseState to language server diagnostics"
+    index = LineIndex(state.text)
+    out = []
+    for err in state.errors():
+        line, col = err.position(index)
+        line = min(line, len(index.starts)) - 1
+        start = index.starts[line]
+        character = len(state.text[start:start + col - 1].encode('utf-16-le')) // 2
+        position = {"line": line, "character": character}
+        out.append({
+            "range": {"start": position, "end": position},
+            "severity": 1,
+            "source": "safeyaml",
+            "code": err.name(),
+            "message": err.explain(),
+        })
+    return out
+
+
+def serve(fh_in, fh_out, options):
+    """Run a language server on binary files, publishing diagnostics for each document as it changes
+
+    Edits are applied with ParseState.edit(), so only the entries they touch
+    are parsed again."""
+    documents = {}
+    while True:
+        message = read_message(fh_in)
+        if message is None:
+            return
+        method = message.get('method')
+        params = message.get('params') or {}
+
+        if method == 'initialize':
+            result = {
+                "capabilities": {"textDocumentSync": {"openClose": True, "change": 2}},
+                "serverInfo": {"name": "safeyaml"},
+            }
+            write_message(fh_out, {"jsonrpc": "2.0", "id": message['id'], "result": result})
+        elif method == 'shutdown':
+            write_message(fh_out, {"jsonrpc": "2.0", "id": message['id'], "result": None})
+        elif method == 'exit':
+            return
+        elif method in ('textDocument/didOpen', 'textDocument/didChange', 'textDocument/didClose'):
+            uri = params['textDocument']['uri']
+            diagnostics = []
+            if method == 'textDocument/didOpen':
+                state = documents[uri] = ParseState(params['textDocument']['text'], options)
+                diagnostics = lsp_diagnostics(state)
+            elif method == 'textDocument/didChange' and uri in documents:
+                state = documents[uri]
+                for change in params['contentChanges']:
+                    if 'range' in change:
+                        index = LineIndex(state.text)
+                        start = lsp_offset(state.text, index, change['range']['start'])
+                        end = lsp_offset(state.text, index, change['range']['end'])
+                        state.edit(start, end, change['text'])
+                    else:
+                        state = documents[uri] = ParseState(change['text'], options)
+                diagnostics = lsp_diagnostics(state)
+            else:
+                documents.pop(uri, None)
+            write_message(fh_out, {"jsonrpc": "2.0", "method": "textDocument/publishDiagnostics",
+                                   "params": {"uri": uri, "diagnostics": diagnostics}})
+        elif 'id' in message and method is not None:
+            write_message(fh_out, {"jsonrpc": "2.0", "id": message['id'],
+                                   "error": {"code": -32601, "message": "Unknown method: {}".format(method)}})
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description="SafeYAML Linter, checks (or formats) a YAML file for common ambiguities")
 
     parser.add_argument("file", nargs="*", default=None,
-                        help="filename to read, without will read from stdin")
+                        help="filenames, directories, or globs to read, without will read from stdin")
     parser.add_argument("--fix",  action='store_true',
                         default=False, help="ask the parser to hog wild")
     parser.add_argument("--fix-unquoted",  action='store_true', default=False,
@@ -699,9 +2461,25 @@ if __name__ == '__main__':
                         default=False, help="don't print cleaned file")
     parser.add_argument("--in-place", action='store_true',
                         default=False, help="edit file")
+    parser.add_argument("--check", action='store_true',
+                        default=False, help="report files that --in-place would change, without changing them")
+    parser.add_argument("--diff", action='store_true',
+                        default=False, help="print the changes the fix options make as a unified diff")
 
     parser.add_argument("--json", action='store_true',
                         default=False, help="output json instead of yaml")
+    parser.add_argument("--schema", default=None,
+                        help="check each document against the schema in this SafeYAML file")
+    parser.add_argument("--all-errors", action='store_true',
+                        default=False, help="report every error in a file, not just the first")
+    parser.add_argument("--lsp", action='store_true',
+                        default=False, help="run as a language server on stdin and stdout")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="check this many files in parallel, 0 for one per CPU")
+    parser.add_argument("--cache", action='store_true', default=False,
+                        help="skip files that haven't changed since the last run")
+    parser.add_argument("--cache-dir", default=None,
+                        help="where to keep the cache, implies --cache (default: {})".format(default_cache_dir()))
 
     args = parser.parse_args()  # will only return when action is given
 
@@ -712,59 +2490,105 @@ if __name__ == '__main__':
         force_commas=args.force_commas,
     )
 
-    if args.in_place:
-        if args.json:
-            print('error: safeyaml --in-place cannot be used with --json')
+    if args.schema:
+        try:
+            with open(args.schema) as fh:
+                options.schema = Schema(parse(fh.read())[0])
+        except ParserErr as p:
+            line, col = p.position()
+            print("{}:{}:{}:{}".format(args.schema, line, col, p.explain()), file=sys.stderr)
+            sys.exit(-2)
+        except (OSError, ValueError) as e:
+            print("{}:1:1:{}".format(args.schema, e), file=sys.stderr)
+            sys.exit(-2)
+
+    if args.lsp:
+        serve(sys.stdin.buffer, sys.stdout.buffer, options)
+        sys.exit(0)
+
+    cache = None
+    if args.cache or args.cache_dir:
+        cache = ResultCache(args.cache_dir)
+
+    batch = len(args.file) > 1 or any(os.path.isdir(path) or (not os.path.exists(path) and any(c in path for c in '*?['))
+                                      for path in args.file)
+
+    if args.in_place or args.check or batch:
+        if args.json or args.diff:
+            if args.in_place or args.check:
+                print('error: safeyaml --in-place and --check cannot be used with --json or --diff')
+            else:
+                print('error: safeyaml --json and --diff only take one file as argument')
             print()
             sys.exit(-2)
 
         if len(args.file) < 1:
-            print('error: safeyaml --in-place takes at least one file')
+            print('error: safeyaml --in-place and --check take at least one file')
             print()
             sys.exit(-2)
 
-        for filename in args.file:
-            with open(filename, 'r+') as fh:
-                try:
-                    output = io.StringIO()
-                    obj = parse(fh.read(), output=output, options=options)
-                except ParserErr as p:
-                    line, col = get_position(p.buf, p.pos)
-                    print("{}:{}:{}:{}".format(filename, line,
-                                               col, p.explain()), file=sys.stderr)
-                    sys.exit(-2)
-                else:
-                    fh.seek(0)
-                    fh.truncate(0)
-                    fh.write(output.getvalue())
+        missing = []
+        filenames = find_files(args.file, missing=missing)
+        for path in missing:
+            print("{}:1:1:no such file or pattern matched nothing".format(path), file=sys.stderr)
+        failed = bool(missing)
+        for filename, error in lint_files(filenames, options, jobs=args.jobs, in_place=args.in_place,
+                                          cache=cache, check=args.check, all_errors=args.all_errors):
+            if error is not None:
+                print(error, file=sys.stderr)
+                failed = True
+
+        if cache is not None:
+            cache.evict()
+
+        if failed:
+            sys.exit(-2)
 
     else:
         input_fh, output_fh = sys.stdin, sys.stdout
         filename = "<stdin>"
 
         if args.file:
-            if len(args.file) > 1:
-                print(
-                    'error: safeyaml only takes one file as argument, unless --in-place given')
-                print()
-                sys.exit(-1)
-
             input_fh = open(args.file[0])  # closed on exit
-            filename = args.file
+            filename = args.file[0]
+
+        buf = None
+        if args.all_errors:
+            buf = input_fh.read()
+            input_fh = io.StringIO(buf)
 
         try:
-            output = io.StringIO()
-            obj = parse(input_fh.read(), output=output, options=options)
+            if args.json and not args.quiet and options.schema is not None:
+                json.dump(list(iter_parse(input_fh, options)), output_fh)
+            elif args.json and not args.quiet:
+                write_json(input_fh, output_fh, options)
+            elif args.json or (args.quiet and cache is None):
+                for obj in iter_parse(input_fh, options):
+                    pass
+            else:
+                buf = input_fh.read()
+                output = None if args.quiet or args.diff else io.StringIO()
+                edits = [] if args.diff else None
+                if cache is not None and not args.diff:
+                    cache.check(buf, output=output, options=options)
+                else:
+                    obj = parse(buf, output=output, options=options, edits=edits)
         except ParserErr as p:
-            line, col = get_position(p.buf, p.pos)
-            print("{}:{}:{}:{}".format(filename, line,
-                                       col, p.explain()), file=sys.stderr)
+            errors, index = [p], None
+            if args.all_errors:
+                recovered = parse_recover(buf, options)[1]
+                if recovered:
+                    errors, index = recovered, LineIndex(buf)
+            for p in errors:
+                line, col = p.position(index)
+                print("{}:{}:{}:{}".format(filename, line,
+                                           col, p.explain()), file=sys.stderr)
             sys.exit(-2)
 
-        if not args.quiet:
+        if not args.quiet and not args.json:
 
-            if args.json:
-                json.dump(obj, output_fh)
+            if args.diff:
+                output_fh.write(format_diff(buf, edits, filename))
             else:
                 output_fh.write(output.getvalue())
 
@@ -1,5 +1,7 @@
 import io
 import os
+import json
+import mmap
 import glob
 import yaml
 import pytest
@@ -18,6 +20,9 @@ SMOKE_TESTS = {
     """ {"a":1} """:        {'a': 1},
     """ {'b':2,} """:       {'b': 2},
     """ [1  #foo\n] """:    [1],
+    """ a: 1 # end """:     {'a': 1},
+    """- 1\n# c\n\n- 2\n""":  [1, 2],
+    """'a': 1\n"b": 2\nc: 3""": {'a': 1, 'b': 2, 'c': 3},
 }
 
 
@@ -27,6 +32,20 @@ def test_smoke(code, ref_obj):
     assert obj == ref_obj
 
 
+@pytest.mark.parametrize("path", glob.glob("tests/*/*.yaml"))
+def test_no_output(path):
+    with open(path) as fh:
+        contents = fh.read()
+    options = safeyaml.Options(fix_unquoted=True, fix_nospace=True)
+    try:
+        obj = safeyaml.parse(contents, output=io.StringIO(), options=options)
+    except safeyaml.ParserErr as p:
+        with pytest.raises(type(p)):
+            safeyaml.parse(contents, options=options)
+    else:
+        assert safeyaml.parse(contents, options=options) == obj
+
+
 @pytest.mark.parametrize("path", glob.glob("tests/validate/*.yaml"))
 def test_validate(path):
     check_file(path, validate=True)
@@ -37,6 +56,704 @@ def test_fix(path):
     check_file(path, fix=True)
 
 
+@pytest.mark.parametrize("path", glob.glob("tests/*/*.yaml") + list(SMOKE_TESTS))
+def test_events(path):
+    if path in SMOKE_TESTS:
+        contents = path
+    else:
+        with open(path) as fh:
+            contents = fh.read()
+
+    try:
+        obj = safeyaml.parse(contents)
+    except safeyaml.ParserErr as p:
+        with pytest.raises(type(p)) as excinfo:
+            list(safeyaml.iter_events(contents))
+        assert excinfo.value.pos == p.pos
+        return
+
+    events = list(safeyaml.iter_events(contents))
+    assert list(safeyaml.build(iter(events))) == obj
+
+    depth = 0
+    for event, start, end, value in events:
+        if event in (safeyaml.START_MAP, safeyaml.START_LIST):
+            depth += 1
+        elif event in (safeyaml.END_MAP, safeyaml.END_LIST):
+            depth -= 1
+        elif event == safeyaml.KEY:
+            assert contents[start:end].strip('"\'').lower() == value
+        assert depth >= 0
+    assert depth == 0
+
+
+def test_events_offsets():
+    events = list(safeyaml.iter_events('a: [1, {b: "x"}]\nc:\n  - 2\n'))
+    assert events == [
+        (safeyaml.START_MAP, 0, 0, None),
+        (safeyaml.KEY, 0, 1, 'a'),
+        (safeyaml.START_LIST, 3, 4, None),
+        (safeyaml.SCALAR, 4, 5, 1),
+        (safeyaml.START_MAP, 7, 8, None),
+        (safeyaml.KEY, 8, 9, 'b'),
+        (safeyaml.SCALAR, 11, 14, 'x'),
+        (safeyaml.END_MAP, 14, 15, None),
+        (safeyaml.END_LIST, 15, 16, None),
+        (safeyaml.KEY, 17, 18, 'c'),
+        (safeyaml.START_LIST, 22, 22, None),
+        (safeyaml.SCALAR, 24, 25, 2),
+        (safeyaml.END_LIST, 25, 25, None),
+        (safeyaml.END_MAP, 26, 26, None),
+    ]
+
+
+@pytest.mark.parametrize("path", glob.glob("tests/*/*.yaml"))
+def test_nodes(path):
+    with open(path) as fh:
+        contents = fh.read()
+    try:
+        obj = safeyaml.parse(contents)
+    except safeyaml.ParserErr:
+        return
+    assert [node.plain() for node in safeyaml.parse_nodes(contents)] == obj
+
+
+def test_node_spans():
+    buf = 'a: [1, {b: "x"}]\nc:\n  - 2\n'
+    root, = safeyaml.parse_nodes(buf)
+    assert isinstance(root, safeyaml.MapNode)
+    assert root.keys == ['a', 'c'] and root.key_starts == [0, 17]
+    assert (root.start, root.end) == (0, 26)
+
+    a = root['a']
+    assert buf[a.start:a.end] == '[1, {b: "x"}]'
+    assert buf[a[1].start:a[1].end] == '{b: "x"}'
+    b = a[1]['b']
+    assert (b.value, buf[b.start:b.end]) == ('x', '"x"')
+    c = root['c']
+    assert isinstance(c, safeyaml.ListNode) and [item.value for item in c] == [2]
+    with pytest.raises(KeyError):
+        root['b']
+
+
+def test_extract():
+    buf = 'a: [1, {b: "x\\ty"}, [2, 3]]\nc:\n  - d: 4\n  - [5]\n---\n[6]\n'
+    assert safeyaml.extract(buf, []) == {'a': [1, {'b': 'x\ty'}, [2, 3]], 'c': [{'d': 4}, [5]]}
+    assert safeyaml.extract(buf, ['a', 1]) == {'b': 'x\ty'}
+    assert safeyaml.extract(buf, ['a', 2, 1]) == 3
+    assert safeyaml.extract(buf, ['c', 0, 'd']) == 4
+    for path in (['b'], ['a', 3], ['a', 'b'], ['c', 1, 0, 0], ['a', -1]):
+        with pytest.raises(KeyError):
+            safeyaml.extract(buf, path)
+
+    with pytest.raises(safeyaml.DuplicateKey):
+        safeyaml.extract("a: 1\nb: {c: 1, c: 2}\n", ['a'])
+    with pytest.raises(safeyaml.ReservedKey):
+        safeyaml.extract("a: 1\n---\n[yes]\n", ['a'])
+
+
+def test_dict_type():
+    buf = '[{"key name": 1}, {"key name": 2}]'
+    first, second = safeyaml.parse(buf)[0]
+    assert type(first) is dict
+    key1, key2 = list(first)[0], list(second)[0]
+    assert key1 is key2
+
+    obj = safeyaml.parse(buf, options=safeyaml.Options(dict_type=safeyaml.OrderedDict))[0]
+    assert type(obj[0]) is safeyaml.OrderedDict
+    assert safeyaml.parse_nodes(buf)[0].plain(safeyaml.OrderedDict) == obj
+
+
+def test_dump():
+    obj = {"name": "a \"b\"", "Port": 80, "on": [1.5, 1e+16, None, True], "nested": {"list": [[1], {}, {"a": [2]}, {"b": 3, "c": 4}]}}
+    assert safeyaml.dumps(obj) == (
+        'name: "a \\"b\\""\n'
+        '"Port": 80\n'
+        '"on":\n'
+        '  - 1.5\n'
+        '  - 1.0e+16\n'
+        '  - null\n'
+        '  - true\n'
+        'nested:\n'
+        '  list:\n'
+        '    -\n'
+        '      - 1\n'
+        '    - {}\n'
+        '    -\n'
+        '      a:\n'
+        '        - 2\n'
+        '    - b: 3\n'
+        '      c: 4\n')
+    assert safeyaml.dumps(obj, flow=True) == (
+        '{name: "a \\"b\\"", "Port": 80, "on": [1.5, 1.0e+16, null, true], '
+        'nested: {list: [[1], {}, {a: [2]}, {b: 3, c: 4}]}}\n')
+
+    for flow in (False, True):
+        for indent in (2, 4):
+            text = safeyaml.dumps(obj, flow=flow, indent=indent)
+            assert safeyaml.parse(text)[0] == obj
+            assert yaml.safe_load(text) == obj
+            output = io.StringIO()
+            safeyaml.dump(obj, output, flow=flow, indent=indent)
+            assert output.getvalue() == text
+
+    assert safeyaml.dumps({"s": "\u2028\x7f"}) == 's: "\\u2028\\u007f"\n'
+
+    # a ': ' on a '- ' line would start a map
+    for obj in (["a: b"], {"k": ["x: y", 1]}, [["#a: b: c"]], [{"a: b": "c: d"}]):
+        text = safeyaml.dumps(obj)
+        assert safeyaml.parse(text)[0] == obj
+        assert yaml.safe_load(text) == obj
+    assert safeyaml.dumps(["a: b"]) == '- "a\\x3a b"\n'
+
+    # keys YAML would read as floats
+    obj = {".5": 1, ".inf": 2, ".nan": 3, ".1_": 4, "._5": 5}
+    text = safeyaml.dumps(obj)
+    assert text == '".5": 1\n".inf": 2\n".nan": 3\n".1_": 4\n._5: 5\n'
+    assert safeyaml.parse(text)[0] == obj
+    assert yaml.safe_load(text) == obj
+
+    for bad in ("text", {1: 2}, [float("nan")], ["\ud800"], [object()]):
+        with pytest.raises((TypeError, ValueError)):
+            safeyaml.dumps(bad)
+    with pytest.raises(ValueError):
+        safeyaml.dumps([{"a": 1, "b": 2}], indent=1)
+
+
+@pytest.mark.parametrize("path", glob.glob("tests/*/*.yaml"))
+def test_dump_fixtures(path):
+    with open(path) as fh:
+        contents = fh.read()
+    try:
+        obj = safeyaml.parse(contents)[0]
+    except safeyaml.ParserErr:
+        return
+    for flow in (False, True):
+        assert safeyaml.parse(safeyaml.dumps(obj, flow=flow))[0] == obj
+
+
+@pytest.mark.parametrize("path", glob.glob("tests/*/*.yaml"))
+def test_write_json(path):
+    with open(path) as fh:
+        contents = fh.read()
+    try:
+        obj = safeyaml.parse(contents)
+    except safeyaml.ParserErr:
+        return
+    output = io.StringIO()
+    safeyaml.write_json(contents, output)
+    assert json.loads(output.getvalue()) == obj
+
+
+def test_write_json_numbers():
+    output = io.StringIO()
+    safeyaml.write_json(io.StringIO("a: +5\nb: -0.50e+3\nc: 00\nd: \"\u00e9\"\n---\n- []\n"), output)
+    assert output.getvalue() == '[{"a": 5, "b": -0.50e+3, "c": 0, "d": "\\u00e9"}, [[]]]'
+
+    output = io.StringIO()
+    with pytest.raises(safeyaml.ReservedKey) as e:
+        safeyaml.write_json(io.StringIO("a: [1]\n---\nb: yes\n"), output)
+    assert e.value.position() == (3, 4)
+
+
+def test_deep():
+    options = safeyaml.Options(max_depth=None)
+    obj = safeyaml.parse("[" * 10000 + "]" * 10000, options=options)[0]
+    for i in range(9999):
+        obj, = obj
+    assert obj == []
+
+    buf = "".join("{}- \n".format(" " * i) for i in range(2000)) + " " * 2000 + "- 1\n"
+    obj = safeyaml.parse(buf, options=options)[0]
+    for i in range(2001):
+        obj, = obj
+    assert obj == 1
+
+
+LIMIT_TESTS = [
+    ("[[[1]]]", dict(max_depth=2), safeyaml.TooDeep, 2),
+    ("a:\n b:\n  - [1]\n", dict(max_depth=3), safeyaml.TooDeep, 11),
+    ("[1, 2, 3]", dict(max_items=2), safeyaml.TooManyItems, 7),
+    ("a: 1\nb: 2\n", dict(max_items=1), safeyaml.TooManyItems, 5),
+    ("- 1\n- 2\n", dict(max_items=1), safeyaml.TooManyItems, 4),
+    ("{a: 1, b: 2}", dict(max_items=1), safeyaml.TooManyItems, 7),
+    ("a: '12345'", dict(max_string_length=4), safeyaml.StringTooLong, 3),
+    ("abcde: 1", dict(max_string_length=4), safeyaml.StringTooLong, 0),
+    ("[1, 2, 3]", dict(max_size=4), safeyaml.TooLarge, 4),
+]
+
+
+@pytest.mark.parametrize("code,limits,error,pos", LIMIT_TESTS)
+def test_limits(code, limits, error, pos):
+    with pytest.raises(error) as excinfo:
+        safeyaml.parse(code, options=safeyaml.Options(**limits))
+    assert excinfo.value.pos == pos
+    assert isinstance(excinfo.value, safeyaml.SemanticErr)
+
+    unlimited = {name: None for name in limits}
+    safeyaml.parse(code, options=safeyaml.Options(**unlimited))
+
+
+SCHEMA = {
+    'type': 'map',
+    'required': ['name'],
+    'extra': False,
+    'keys': {
+        'name': {'type': 'string'},
+        'port': {'type': 'int', 'min': 1, 'max': 65535},
+        'mode': {'enum': ['fast', 'slow']},
+        'tags': {'type': 'list', 'items': {'type': 'string'}},
+        'limits': {'type': ['map', 'null'], 'extra': {'type': 'number'}},
+    },
+}
+
+SCHEMA_TESTS = [
+    ("name: 1\n", 6, "Expected a string for 'name', found an int"),
+    ("name: 'a'\nport: 0\n", 16, "Expected at least 1 for 'port', found 0"),
+    ("name: 'a'\nport: 70000\n", 16, "Expected at most 65535 for 'port', found 70000"),
+    ("name: 'a'\nmode: 'x'\n", 16, "Expected one of 'fast', 'slow' for 'mode', found 'x'"),
+    ("name: 'a'\nhost: 'x'\n", 10, "Unexpected key 'host', expected one of: name, port, mode, tags, limits"),
+    ("name: 'a'\ntags:\n  - 'a'\n  - 2\n", 28, "Expected a string for a list item, found an int"),
+    ("name: 'a'\ntags: {a: 1}\n", 16, "Expected a list for 'tags', found a map"),
+    ("name: 'a'\nlimits: {cpu: true}\n", 24, "Expected a number for 'cpu', found a bool"),
+    ("port: 80\n", 0, "Missing required key 'name'"),
+    ("{name: 'a', limits: {}}\n---\n[]\n", 28, "Expected a map for the document, found a list"),
+]
+
+
+@pytest.mark.parametrize("code,pos,reason", SCHEMA_TESTS)
+def test_schema(code, pos, reason):
+    options = safeyaml.Options(schema=safeyaml.Schema(SCHEMA))
+    with pytest.raises(safeyaml.SchemaErr) as excinfo:
+        safeyaml.parse(code, options=options)
+    assert excinfo.value.pos == pos
+    assert excinfo.value.reason == reason
+    assert isinstance(excinfo.value, safeyaml.SemanticErr)
+
+
+def test_schema_valid():
+    code = "name: 'a'\nport: 80\ntags: ['a', 'b']\nlimits: {cpu: 0.5, memory: 512}\n---\n{name: 'b', limits: null}\n"
+    options = safeyaml.Options(schema=safeyaml.Schema(SCHEMA), dict_type=safeyaml.OrderedDict)
+    assert safeyaml.parse(code, options=options) == safeyaml.parse(code)
+    assert list(safeyaml.iter_parse(io.StringIO(code), options)) == safeyaml.parse(code)
+
+    for spec in ({'type': 'str'}, {'keys': {'a': {'min': 1, 'maximum': 2}}}, ['map']):
+        with pytest.raises(ValueError):
+            safeyaml.Schema(spec)
+
+
+def test_schema_recover():
+    options = safeyaml.Options(schema=safeyaml.Schema(SCHEMA))
+    expected = [
+        ("SchemaErr", (1, 1)),
+        ("SchemaErr", (1, 7)),
+        ("SchemaErr", (2, 1)),
+        ("ReservedKey", (2, 4)),
+        ("SchemaErr", (3, 13)),
+        ("SchemaErr", (7, 1)),
+    ]
+    code = "port: 0\nb: yes\ntags: ['a', 2]\n---\nname: 'a'\n---\n- 1\n"
+    errors = sorted(safeyaml.parse_recover(code, options)[1], key=lambda err: err.pos)
+    assert [(err.name(), err.position()) for err in errors] == expected
+    errors = safeyaml.ParseState(code, options).errors()
+    assert [(err.name(), err.position()) for err in errors] == expected
+    assert errors[0].reason == "Missing required key 'name'"
+    assert errors[5].reason == "Expected a map for the document, found a list"
+
+
+def test_strings():
+    obj = safeyaml.parse(r'''["plain", "a\tb\né\x41\U0001F600", 'it\'s']''')[0]
+    assert obj == ["plain", "a\tb\né\x41\U0001F600", "it's"]
+
+    with pytest.raises(safeyaml.BadString) as excinfo:
+        safeyaml.parse(r'a: "ok \ud800"')
+    assert excinfo.value.pos == 7
+
+
+def test_iter_parse():
+    buf = "# header\n---\na: 1\n---\n[2]\n---\n[3]---[4]\n"
+    docs = [{'a': 1}, [2], [3], [4]]
+    assert safeyaml.parse(buf) == docs
+    assert list(safeyaml.iter_parse(buf)) == docs
+    assert list(safeyaml.iter_parse(io.StringIO(buf))) == docs
+
+    stream = safeyaml.iter_parse(io.StringIO("a: 1\n---\nb: 2\nc: yes\n"))
+    assert next(stream) == {'a': 1}
+    with pytest.raises(safeyaml.ReservedKey) as excinfo:
+        next(stream)
+    assert excinfo.value.position() == (4, 4)
+
+    with pytest.raises(safeyaml.NoRootObject):
+        list(safeyaml.iter_parse(io.StringIO("")))
+
+
+def parse_result(fn):
+    try:
+        return fn()
+    except safeyaml.ParserErr as p:
+        return p.name(), p.position()
+
+
+@pytest.mark.parametrize("code", [
+    "- 1\n---\n- 2\n",
+    "a:\n---\n  b: 1\n",
+    "a: 1\n---",
+    "[1,\n---\n2]",
+    "a: 1\nb:\n---\n  - 3\n",
+    "a: 1\n----\nb: 2\n",
+    "\ufeffa: 1\n---\nb: [1,\n",
+    "a: 1\n--- # c\nb: 1\n---\n- 1\n---\nc: yes\n",
+])
+def test_iter_parse_matches_parse(code):
+    expected = parse_result(lambda: safeyaml.parse(code))
+    assert parse_result(lambda: list(safeyaml.iter_parse(io.StringIO(code)))) == expected
+    assert parse_result(lambda: list(safeyaml.iter_parse(io.BytesIO(code.encode())))) == expected
+
+
+def test_bytes_input(tmp_path):
+    text = "a: \"\u00e9\"\nb: [1, 2]\n---\nc: 3\n"
+    buf = text.encode('utf-8')
+    docs = [{'a': '\u00e9', 'b': [1, 2]}, {'c': 3}]
+    for source in (buf, bytearray(buf), memoryview(buf)):
+        assert safeyaml.parse(source) == docs
+    assert list(safeyaml.iter_parse(io.BytesIO(buf))) == docs
+    assert list(safeyaml.iter_events(buf)) == list(safeyaml.iter_events(text))
+
+    path = tmp_path / "input.yaml"
+    path.write_bytes(buf)
+    with open(path, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        assert safeyaml.parse(mm) == docs
+        assert list(safeyaml.iter_parse(mm)) == docs
+
+    with pytest.raises(safeyaml.ReservedKey) as excinfo:
+        safeyaml.parse("a: \"\u00e9\"\nb: yes\n".encode('utf-8'))
+    assert excinfo.value.position() == (2, 4)
+
+
+def test_line_index():
+    buf = "a: 1\r\nb:\n  - 2\n\n# c\nd: 3"
+    index = safeyaml.LineIndex(buf)
+    for pos in range(len(buf) + 1):
+        line = buf.count('\n', 0, pos) + 1
+        col = pos - (buf.rfind('\n', 0, pos) + 1) + 1
+        assert index.position(pos) == (line, col)
+        assert safeyaml.get_position(buf, pos) == (line, col)
+
+    with pytest.raises(safeyaml.ParserErr) as excinfo:
+        safeyaml.parse(buf.replace('3', 'yes'))
+    assert excinfo.value.position() == (6, 4)
+    assert excinfo.value.position(index) == (6, 4)
+
+
+@pytest.mark.parametrize("path", glob.glob("tests/fix/*.yaml"))
+def test_edits(path):
+    with open(path) as fh:
+        contents = fh.read()
+    options = safeyaml.Options(fix_unquoted=True, fix_nospace=True, force_commas=True)
+    output, edits = io.StringIO(), []
+    safeyaml.parse(contents, output=output, options=options, edits=edits)
+    assert edits == sorted(edits)
+    assert safeyaml.apply_edits(contents, edits) == output.getvalue()
+
+
+def test_format_diff():
+    buf = "a:1\nb: 2\nc: 3\nd: 4\ne: 5\nf: 6\ng: 7\nh: 8\ni: 9\nj: x"
+    edits = []
+    safeyaml.parse(buf, options=safeyaml.Options(fix_unquoted=True, fix_nospace=True), edits=edits)
+    assert edits == [(2, 0, ' '), (47, 1, '"x"')]
+    assert safeyaml.format_diff(buf, edits, "f.yaml", context=1) == (
+        "--- f.yaml\n+++ f.yaml\n"
+        "@@ -1,2 +1,2 @@\n-a:1\n+a: 1\n b: 2\n"
+        "@@ -9,2 +9,2 @@\n i: 9\n-j: x\n\\ No newline at end of file\n+j: \"x\"\n\\ No newline at end of file\n")
+    assert safeyaml.format_diff(buf, [], "f.yaml") == ""
+
+
+def test_lint_files(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "ok.yaml").write_text("a: 1\n")
+    (tmp_path / "bad.yaml").write_text("a: 1\nb: yes\n")
+    (tmp_path / "sub" / "bad.yml").write_text("[1 2]")
+    (tmp_path / "sub" / "cut.yaml").write_text("a: [1,")
+    (tmp_path / "sub" / "notes.txt").write_text("yes")
+
+    filenames = safeyaml.find_files([str(tmp_path)])
+    assert filenames == [str(tmp_path / name) for name in ("bad.yaml", "ok.yaml", "sub/bad.yml", "sub/cut.yaml")]
+    assert safeyaml.find_files([str(tmp_path / "*.yaml")]) == filenames[:2]
+
+    (tmp_path / "sub" / "x[1].yaml").write_text("a: 1\n")
+    missing = []
+    paths = [str(tmp_path / "sub" / "x[1].yaml"), str(tmp_path / "nomatch*.yaml"), str(tmp_path / "gone.yaml")]
+    assert safeyaml.find_files(paths, missing=missing) == paths[:1]
+    assert missing == paths[1:]
+    (tmp_path / "sub" / "x[1].yaml").unlink()
+
+    options = safeyaml.Options()
+    for jobs in (1, 2):
+        errors = [error for filename, error in safeyaml.lint_files(filenames, options, jobs=jobs) if error]
+        assert errors[0].startswith("{}:2:4:".format(filenames[0]))
+        assert errors[1].startswith("{}:1:4:".format(filenames[2]))
+        assert errors[2] == "{}:1:7:Unexpected end of file".format(filenames[3])
+        assert len(errors) == 3
+
+
+RECOVER_TESTS = [
+    ("a: 1\nb: yes\nc: 3\nd: no\n", [{'a': 1, 'b': None, 'c': 3, 'd': None}], [(2, 4), (4, 4)]),
+    ("a: [1, 2 3, 4]\nb: {x: 1 y: 2, z: 3}\n", [{'a': [1, 2, 4], 'b': {'x': 1, 'z': 3}}], [(1, 10), (2, 10)]),
+    ("a: [1, 2\nb: 3\n", [{'a': [1, 2], 'b': 3}], [(2, 1)]),
+    ("a b:\n  c: 1\nd: 2\n", [{'d': 2}], [(1, 2)]),
+    ("a:\n  - 1\n  -2\n  - &x\nb: 4\n", [{'a': [1], 'b': 4}], [(3, 4), (4, 5)]),
+    ("a: 1\n---\n[1 2]\n---\n- 3\n", [{'a': 1}, [1], [3]], [(3, 4)]),
+    ("{a: [1, 2", [{'a': [1, 2]}], [(1, 10)]),
+    ("k0:\n  - 1\n   -2\nz0: yes\n", [{'k0': [1], 'z0': None}], [(3, 4), (4, 5)]),
+]
+
+
+@pytest.mark.parametrize("code,objs,positions", RECOVER_TESTS)
+def test_parse_recover(code, objs, positions):
+    out, errors = safeyaml.parse_recover(code)
+    assert out == objs
+    assert [e.position() for e in errors] == positions
+
+
+@pytest.mark.parametrize("code,ref_obj", SMOKE_TESTS.items())
+def test_parse_recover_valid(code, ref_obj):
+    assert safeyaml.parse_recover(code) == ([ref_obj], [])
+
+
+def test_lint_all_errors(tmp_path):
+    path = tmp_path / "bad.yaml"
+    path.write_text("a: yes\nb: [1 2]\nc: 3\n")
+    options = safeyaml.Options()
+    assert safeyaml.lint_file(str(path), options).count("\n") == 0
+    errors = safeyaml.lint_file(str(path), options, all_errors=True).split("\n")
+    assert [e[len(str(path)):].split(":")[1:3] for e in errors] == [["1", "4"], ["2", "7"]]
+
+
+def test_parse_state():
+    text = "a: 1\nb:\n  - 2\n  - 3\nc: {d: [4,\n5]}\n"
+    state = safeyaml.ParseState(text)
+    assert [block.start for block in state.blocks] == [0, 5, 20]
+    assert state.errors() == []
+
+    for start, end, insert in [(3, 4, "yes"), (15, 16, ""), (0, 0, "c: 0\n"), (27, 28, "[,"), (4, 4, "\n---\n- 1")]:
+        text = text[:start] + insert + text[end:]
+        state.edit(start, end, insert)
+        fresh = safeyaml.ParseState(text)
+        assert state.text == text
+        assert [(block.start, block.state) for block in state.blocks] == [(block.start, block.state) for block in fresh.blocks]
+        errors = [(e.name(), e.position()) for e in state.errors()]
+        assert errors == [(e.name(), e.position()) for e in fresh.errors()]
+        assert errors == [(e.name(), e.position()) for e in sorted(safeyaml.parse_recover(text)[1], key=lambda e: e.pos)]
+
+
+@pytest.mark.parametrize("text", [
+    "- 1\n---\n- 2\n",
+    "\nc: 1\n:\n-ba:b: #'- [{-[",
+    "a: 1\nb:\n---\n  - 3\n",
+    "a:\n---\n  b: 1\n",
+    "a: 1\n---",
+    "- 1#\n- 2\n",
+    "- 1#\n---\n- 2\n",
+    "  - 1\n---\n[1]\n",
+    "\nb:\n- a: 1\n---\n  - 1\n",
+    "b:\n  - 1\nb:\n",
+    "a: 1\na: 1\n- x\n",
+    "a: 1---\n---\nb: 2\n",
+    "c: 0\nc[, {d: [4,\n5]}\n",
+    "a: 1\n---\n  b: 1\n  c: 2\nd:\n  b: 3\n  c: 4\n",
+])
+def test_parse_state_documents(text):
+    errors = [(e.name(), e.position()) for e in safeyaml.ParseState(text).errors()]
+    assert errors == [(e.name(), e.position()) for e in sorted(safeyaml.parse_recover(text)[1], key=lambda e: e.pos)]
+    try:
+        safeyaml.parse(text)
+    except safeyaml.ParserErr:
+        assert errors
+    else:
+        assert errors == []
+
+
+def lsp_messages(*messages):
+    out = []
+    for message in messages:
+        body = json.dumps(message).encode('utf-8')
+        out.append("Content-Length: {}\r\n\r\n".format(len(body)).encode('ascii') + body)
+    return io.BytesIO(b"".join(out))
+
+
+def test_language_server():
+    uri = "file:///config.yaml"
+    fh_in = lsp_messages(
+        {"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {}},
+        {"jsonrpc": "2.0", "method": "textDocument/didOpen",
+         "params": {"textDocument": {"uri": uri, "text": "a: 1\nb: \"\U0001F600\" x\n"}}},
+        {"jsonrpc": "2.0", "method": "textDocument/didChange",
+         "params": {"textDocument": {"uri": uri}, "contentChanges": [
+             {"range": {"start": {"line": 1, "character": 7}, "end": {"line": 1, "character": 9}}, "text": ""}]}},
+        {"jsonrpc": "2.0", "id": 2, "method": "shutdown"},
+        {"jsonrpc": "2.0", "method": "exit"},
+    )
+    fh_out = io.BytesIO()
+    safeyaml.serve(fh_in, fh_out, safeyaml.Options())
+
+    fh_out.seek(0)
+    replies = []
+    while True:
+        message = safeyaml.read_message(fh_out)
+        if message is None:
+            break
+        replies.append(message)
+    assert replies[0]["result"]["capabilities"]["textDocumentSync"]["change"] == 2
+    opened, changed = replies[1]["params"]["diagnostics"], replies[2]["params"]["diagnostics"]
+    assert [(d["code"], d["range"]["start"]) for d in opened] == [("TrailingContent", {"line": 1, "character": 8})]
+    assert changed == []
+    assert replies[3] == {"jsonrpc": "2.0", "id": 2, "result": None}
+
+
+def test_lint_in_place(tmp_path):
+    clean, dirty = tmp_path / "clean.yaml", tmp_path / "dirty.yaml"
+    clean.write_text("a: 1\r\nb: 2\r\n")
+    dirty.write_text("a: 1\nb:{c:1}\n")
+    for path in (clean, dirty):
+        os.utime(path, (0, 0))
+    filenames = [str(clean), str(dirty)]
+    options = safeyaml.Options(fix_nospace=True)
+
+    errors = [error for filename, error in safeyaml.lint_files(filenames, options, check=True)]
+    assert errors == [None, "{}:2:3:File would be changed by --in-place".format(dirty)]
+    assert os.stat(dirty).st_mtime == 0
+
+    errors = [error for filename, error in safeyaml.lint_files(filenames, options, in_place=True)]
+    assert errors == [None, None]
+    assert os.stat(clean).st_mtime == 0
+    assert clean.read_bytes() == b"a: 1\r\nb: 2\r\n"
+    assert dirty.read_text() == "a: 1\nb: {c: 1}\n"
+    assert sorted(os.listdir(tmp_path)) == ["clean.yaml", "dirty.yaml"]
+
+    link = tmp_path / "link.yaml"
+    link.symlink_to(dirty)
+    dirty.write_text("a:1\n")
+    assert safeyaml.lint_file(str(link), options, in_place=True) is None
+    assert link.is_symlink()
+    assert dirty.read_text() == "a: 1\n"
+
+
+def test_result_cache(tmp_path, monkeypatch):
+    cache = safeyaml.ResultCache(str(tmp_path / "cache"))
+    options = safeyaml.Options(fix_nospace=True)
+
+    output = io.StringIO()
+    cache.check("a:1\n", options=options, output=output)
+    assert output.getvalue() == "a: 1\n"
+    with pytest.raises(safeyaml.ReservedKey):
+        cache.check("on: 1\n", options=options)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("parse() called on a cache hit")
+    monkeypatch.setattr(safeyaml, "parse", fail)
+
+    output = io.StringIO()
+    cache.check("a:1\n", options=options, output=output)
+    assert output.getvalue() == "a: 1\n"
+    with pytest.raises(safeyaml.ReservedKey) as excinfo:
+        cache.check("on: 1\n", options=options)
+    assert excinfo.value.pos == 0
+
+    with pytest.raises(AssertionError):
+        cache.check("a:1\n", options=safeyaml.Options())
+
+    cache.max_size = 0
+    cache.evict()
+    with pytest.raises(AssertionError):
+        cache.check("a:1\n", options=options)
+
+
+def test_result_cache_evict(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache = safeyaml.ResultCache(str(cache_dir), max_age=60)
+    cache.check("a: 1\n")
+    yaml_path = tmp_path / "a.yaml"
+    yaml_path.write_text("a: 1\n")
+    safeyaml.load_cached(str(yaml_path), cache_dir=str(cache_dir))
+    entries = sorted(cache_dir.glob("*/*"))
+    assert [path.suffix for path in entries] in ([".json", ".marshal"], [".marshal", ".json"])
+
+    foreign = [cache_dir / "notes.txt", cache_dir / "sub" / "notes.txt", entries[0].parent / "notes.txt",
+               cache_dir / "sub" / entries[0].name]
+    for path in foreign:
+        path.parent.mkdir(exist_ok=True)
+        path.write_text("keep me\n")
+    for path in entries + foreign:
+        os.utime(str(path), (0, 0))
+
+    cache.evict()
+    assert not any(path.exists() for path in entries)
+    assert all(path.exists() for path in foreign)
+
+    cache.max_age, cache.max_size = None, 0
+    cache.evict()
+    assert all(path.exists() for path in foreign)
+
+
+def test_load_cached(tmp_path, monkeypatch):
+    path, cache_dir = tmp_path / "a.yaml", str(tmp_path / "cache")
+    path.write_text("a: [1, 2.5, 'x', true, null]\n---\nb: {}\n")
+    docs = safeyaml.load_cached(str(path), cache_dir=cache_dir)
+    assert docs == safeyaml.parse(path.read_text())
+
+    def fail(*args, **kwargs):
+        raise AssertionError("parse() called on a cache hit")
+    monkeypatch.setattr(safeyaml, "parse", fail)
+    assert safeyaml.load_cached(str(path), cache_dir=cache_dir) == docs
+
+    path.write_text("a: 2\n")
+    with pytest.raises(AssertionError):
+        safeyaml.load_cached(str(path), cache_dir=cache_dir)
+    with pytest.raises(AssertionError):
+        safeyaml.load_cached(str(tmp_path / "a.yaml"), options=safeyaml.Options(max_depth=2), cache_dir=cache_dir)
+    monkeypatch.undo()
+
+    path.write_text("a: yes\n")
+    with pytest.raises(safeyaml.ReservedKey):
+        safeyaml.load_cached(str(path), cache_dir=cache_dir)
+    path.write_text("a: 1\n")
+    options = safeyaml.Options(dict_type=safeyaml.OrderedDict)
+    assert safeyaml.load_cached(str(path), options=options, cache_dir=cache_dir) == [{'a': 1}]
+
+
+def test_config_cache(tmp_path):
+    a, b = tmp_path / "a.yaml", tmp_path / "b.yaml"
+    a.write_text("a: 1\n")
+    b.write_text("b: yes\n")
+    changes = []
+    cache = safeyaml.ConfigCache(max_entries=1, on_change=lambda path, docs: changes.append((path, docs)))
+
+    docs = cache.load(str(a))
+    assert docs == [{'a': 1}]
+    assert cache.load(str(a)) is docs
+
+    a.write_text("a: 22\n")
+    assert cache.load(str(a)) == [{'a': 22}]
+    assert changes == [(str(a), [{'a': 22}])]
+
+    with pytest.raises(safeyaml.ReservedKey):
+        cache.load(str(b))
+    assert list(cache.entries) == [str(b)]
+    with pytest.raises(safeyaml.ReservedKey) as first:
+        cache.load(str(b))
+    with pytest.raises(safeyaml.ReservedKey) as second:
+        cache.load(str(b))
+    assert first.value is not second.value
+    assert second.value.pos == 3
+
+    b.write_text("b: true\n")
+    cache.refresh()
+    assert changes[-1] == (str(b), [{'b': True}])
+    b.unlink()
+    cache.refresh()
+    assert not cache.entries
+
+
 def check_file(path, validate=False, fix=False):
     output_file = '{}.output'.format(path)
     error_file = '{}.error'.format(path)